@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, NamedTuple, Optional
 
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -19,31 +21,40 @@ TEMPLATES_DIR = BASE_DIR / "templates"
 # ==================================================
 # PLANOS / LIMITES SAAS (LEGADO)
 # ==================================================
-PLAN_LIMITS: Dict[str, Dict[str, Any]] = {
-    "free": {
-        "max_products": 3,
-        "auto_ingest": False,
-        "link_guardian": False,
-        "featured_allowed": False,
-    },
-    "pro": {
-        "max_products": 20,
-        "auto_ingest": True,
-        "link_guardian": True,
-        "featured_allowed": True,
-    },
-    "don": {
-        "max_products": None,
-        "auto_ingest": True,
-        "link_guardian": True,
-        "featured_allowed": True,
-    },
+class PlanLimit(NamedTuple):
+    max_products: Optional[int]  # None = ilimitado
+    auto_ingest: bool
+    link_guardian: bool
+    featured_allowed: bool
+
+
+PLAN_LIMITS: Dict[str, PlanLimit] = {
+    "free": PlanLimit(
+        max_products=3,
+        auto_ingest=False,
+        link_guardian=False,
+        featured_allowed=False,
+    ),
+    "pro": PlanLimit(
+        max_products=20,
+        auto_ingest=True,
+        link_guardian=True,
+        featured_allowed=True,
+    ),
+    "don": PlanLimit(
+        max_products=None,
+        auto_ingest=True,
+        link_guardian=True,
+        featured_allowed=True,
+    ),
 }
 
 
-def _join_url(base: str, path: str) -> str:
+def _normalize_base(base: str) -> str:
+    """
+    Retorna a base canônica `http(s)://host`, sem barra no final.
+    """
     base = (base or "").strip()
-    path = (path or "").strip()
 
     if not base:
         base = "http://localhost"
@@ -51,10 +62,17 @@ def _join_url(base: str, path: str) -> str:
     if not base.startswith(("http://", "https://")):
         base = "http://" + base
 
+    return base.rstrip("/")
+
+
+def _append_path(base: str, path: str) -> str:
+    # `base` já deve vir normalizada por _normalize_base
+    path = (path or "").strip()
+
     if not path.startswith("/"):
         path = "/" + path
 
-    return base.rstrip("/") + path
+    return base + path
 
 
 class Settings(BaseSettings):
@@ -70,6 +88,13 @@ class Settings(BaseSettings):
 
     # DATABASE
     DATABASE_URL: str = "sqlite:///./blacklink.db"
+    # cria tabelas/colunas no boot; desligar (0) quando o schema for gerido fora do app
+    BLACKLINK_AUTO_MIGRATE: bool = True
+    # DATABASE_URL aponta para um pooler externo (ex.: PgBouncer em modo transaction):
+    # o app não mantém pool próprio (NullPool)
+    DB_EXTERNAL_POOLER: bool = False
+    # loga queries acima deste tempo (ms); 0 desliga
+    DB_SLOW_QUERY_MS: int = 100
 
     # MERCADO PAGO — AMBIENTE
     MP_ENV: str = "test"  # test | production
@@ -78,6 +103,8 @@ class Settings(BaseSettings):
     MP_ACCESS_TOKEN: Optional[str] = None
     MP_PUBLIC_KEY: Optional[str] = None
     MP_WEBHOOK_SECRET: Optional[str] = None
+    # idade máxima (s) do ts da x-signature: fora disso é replay
+    MP_SIGNATURE_TOLERANCE_SECONDS: int = 300
 
     # ✅ WEBHOOK TEST MODE (pra testar sem pagamento real)
     WEBHOOK_TEST_MODE: bool = False
@@ -94,11 +121,15 @@ class Settings(BaseSettings):
     MP_FAILURE_URL: Optional[str] = None
     MP_PENDING_URL: Optional[str] = None
 
-    def model_post_init(self, __context: Any) -> None:
-        self.MP_WEBHOOK_URL = self.MP_WEBHOOK_URL or _join_url(self.APP_BASE_URL, self.MP_WEBHOOK_PATH)
-        self.MP_SUCCESS_URL = self.MP_SUCCESS_URL or _join_url(self.APP_BASE_URL, self.MP_SUCCESS_PATH)
-        self.MP_FAILURE_URL = self.MP_FAILURE_URL or _join_url(self.APP_BASE_URL, self.MP_FAILURE_PATH)
-        self.MP_PENDING_URL = self.MP_PENDING_URL or _join_url(self.APP_BASE_URL, self.MP_PENDING_PATH)
+    @model_validator(mode="after")
+    def _build_mp_urls(self) -> "Settings":
+        # normaliza a base UMA vez e reaproveita nas 4 URLs
+        base = _normalize_base(self.APP_BASE_URL)
+
+        self.MP_WEBHOOK_URL = self.MP_WEBHOOK_URL or _append_path(base, self.MP_WEBHOOK_PATH)
+        self.MP_SUCCESS_URL = self.MP_SUCCESS_URL or _append_path(base, self.MP_SUCCESS_PATH)
+        self.MP_FAILURE_URL = self.MP_FAILURE_URL or _append_path(base, self.MP_FAILURE_PATH)
+        self.MP_PENDING_URL = self.MP_PENDING_URL or _append_path(base, self.MP_PENDING_PATH)
 
         # 🔥 HARD FAIL EM PRODUÇÃO (mas permite WEBHOOK_TEST_MODE)
         if self.ENV == "prod":
@@ -109,5 +140,20 @@ class Settings(BaseSettings):
             if not self.WEBHOOK_TEST_MODE and not self.MP_ACCESS_TOKEN:
                 raise RuntimeError("MP_ACCESS_TOKEN é obrigatório em produção (exceto WEBHOOK_TEST_MODE)")
 
+        return self
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Settings é instanciado uma única vez por processo.
+    Use get_settings() em código novo; `settings` fica por compatibilidade.
+
+    A validação completa do pydantic é mantida de propósito (sem
+    model_construct): ela converte tipos vindos do env/.env (ex.:
+    WEBHOOK_TEST_MODE="true" -> bool) e, com o cache, roda uma vez só.
+    """
+    return Settings()
+
 
-settings = Settings()
+settings = get_settings()
@@ -1,29 +1,89 @@
 from __future__ import annotations
 
+import logging
+import time
+import zlib
 from typing import Dict, Generator
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
 
-from app.config import settings
+from app.config import get_settings
 
-DATABASE_URL = settings.DATABASE_URL
+DATABASE_URL = get_settings().DATABASE_URL
+SLOW_QUERY_SECONDS = get_settings().DB_SLOW_QUERY_MS / 1000
+
+logger = logging.getLogger("blacklink")
 
 if DATABASE_URL.startswith("sqlite"):
+    if DATABASE_URL in ("sqlite://", "sqlite:///:memory:"):
+        # banco em memória só existe dentro de UMA conexão
+        engine = create_engine(
+            DATABASE_URL,
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+    else:
+        # com WAL, várias conexões leem em paralelo
+        engine = create_engine(
+            DATABASE_URL,
+            connect_args={"check_same_thread": False, "timeout": 30},
+            poolclass=QueuePool,
+            pool_size=10,
+            max_overflow=20,
+        )
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _conn_record) -> None:
+        # WAL: leitores não bloqueiam o escritor; NORMAL é seguro com WAL
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        # cache_size é por conexão (até 30 no pool); o mmap é compartilhado via page cache do SO
+        cursor.execute("PRAGMA cache_size=-20000")  # ~20 MB
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        cursor.close()
+elif get_settings().DB_EXTERNAL_POOLER:
+    # o pooler externo multiplexa as conexões no Postgres: aqui cada
+    # checkout abre/fecha uma conexão barata com ele (sem pool duplo)
+    engine = create_engine(DATABASE_URL, poolclass=NullPool, echo=False)
+else:
     engine = create_engine(
         DATABASE_URL,
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
+        pool_pre_ping=True,
+        pool_size=20,
+        max_overflow=10,
+        pool_timeout=10,  # falha rápido em vez de segurar o request 30s
+        pool_recycle=3600,
+        echo=False,
     )
-else:
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+
+if SLOW_QUERY_SECONDS > 0:
+    # log de query lenta: pega regressões (N+1, scan sem índice) em produção
+    @event.listens_for(engine, "before_cursor_execute")
+    def _query_started(conn, _cursor, _statement, _params, _context, _executemany) -> None:
+        conn.info["query_started_at"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _query_finished(conn, _cursor, statement, _params, _context, _executemany) -> None:
+        elapsed = time.perf_counter() - conn.info["query_started_at"]
+        if elapsed >= SLOW_QUERY_SECONDS:
+            logger.warning(f"🐢 Query lenta ({elapsed * 1000:.0f} ms): {statement}")
+
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
 def get_db() -> Generator:
+    """
+    Uma Session por request.
+    O FastAPI cacheia dependências dentro do mesmo request: todo
+    Depends(get_db) (inclusive em sub-dependências) recebe esta mesma
+    instância — não há necessidade de scoped_session.
+    """
     db = SessionLocal()
     try:
         yield db
@@ -31,73 +91,122 @@ def get_db() -> Generator:
         db.close()
 
 
+USER_COLS: Dict[str, str] = {
+    "display_name": "VARCHAR(150)",
+    "bio": "TEXT",
+    "email": "VARCHAR(180)",
+    "avatar_url": "TEXT",
+    "main_cta_url": "TEXT",
+    "main_cta_label": "TEXT",
+    "main_cta_subtitle": "TEXT",
+    "instagram_url": "TEXT",
+    "tiktok_url": "TEXT",
+    "youtube_url": "TEXT",
+    "telegram_url": "TEXT",
+    "linkedin_url": "TEXT",
+    "github_url": "TEXT",
+    "facebook_url": "TEXT",
+    "kwai_url": "TEXT",
+    "mercadolivre_url": "TEXT",
+    "plan": "VARCHAR(20)",
+    "plan_status": "VARCHAR(20)",
+    "plan_started_at": "DATETIME",
+    "plan_expires_at": "DATETIME",
+    "last_paid_plan": "VARCHAR(20)",
+    "last_paid_expires_at": "DATETIME",
+    "mp_customer_id": "VARCHAR(120)",
+    "mp_subscription_id": "VARCHAR(120)",
+}
+
+PRODUCT_COLS: Dict[str, str] = {
+    "description": "TEXT",
+    "url": "VARCHAR(600)",
+    "image_url": "TEXT",
+    "source_image_url": "TEXT",
+    "price": "VARCHAR(50)",
+    "tag": "TEXT",
+    "badge": "TEXT",
+    "cta_label": "TEXT",
+    "is_active": "INTEGER DEFAULT 1",
+    "is_featured": "INTEGER DEFAULT 0",
+    "created_at": "DATETIME",
+    "dead_strike_count": "INTEGER DEFAULT 0",
+    "last_dead_check_at": "DATETIME",
+}
+
+# Índices declarados em models.py (__table_args__), recriados aqui para
+# bancos que já existiam antes deles (create_all não mexe em tabela existente).
+INDEXES: Dict[str, str] = {
+    "ix_products_owner_active": "blacklink_products (owner_id, is_active)",
+    "ix_products_owner_id": "blacklink_products (owner_id, id)",
+    "ix_products_active_id": "blacklink_products (is_active, id)",
+}
+
+def _schema_version() -> int:
+    """
+    Assinatura do schema esperado, gravada em `PRAGMA user_version`:
+    tabelas/colunas/índices do Base.metadata + USER_COLS/PRODUCT_COLS/INDEXES.
+    Calculada na chamada (e não no import) porque os models registram as
+    tabelas depois deste módulo. crc32 (e não hash()) porque o hash de str
+    muda a cada processo.
+    """
+    tables = sorted(
+        (
+            t.name,
+            sorted(c.name for c in t.columns),
+            sorted(i.name for i in t.indexes),
+        )
+        for t in Base.metadata.tables.values()
+    )
+    return zlib.crc32(
+        repr((
+            tables,
+            sorted(USER_COLS.items()),
+            sorted(PRODUCT_COLS.items()),
+            sorted(INDEXES.items()),
+        )).encode()
+    ) & 0x7FFFFFFF
+
+
 def ensure_sqlite_schema(db_engine) -> None:
     """
-    SQLite bootstrap profissional:
+    SQLite bootstrap profissional, numa única transação:
     1) Cria TODAS as tabelas se não existirem
     2) Aplica ALTER TABLE apenas para colunas novas
-    """
+    3) Cria os índices de INDEXES que faltarem
 
-    # 🔥 PASSO 1 — CRIA TABELAS (ESSENCIAL)
-    Base.metadata.create_all(bind=db_engine)
+    Se `PRAGMA user_version` já bate com _schema_version(), nenhum DDL roda
+    (boot comum do container = uma leitura de PRAGMA).
+    """
 
     if not str(db_engine.url).startswith("sqlite"):
+        Base.metadata.create_all(bind=db_engine)
         return
 
-    user_cols: Dict[str, str] = {
-        "display_name": "VARCHAR(150)",
-        "bio": "TEXT",
-        "email": "VARCHAR(180)",
-        "avatar_url": "TEXT",
-        "main_cta_url": "TEXT",
-        "main_cta_label": "TEXT",
-        "main_cta_subtitle": "TEXT",
-        "instagram_url": "TEXT",
-        "tiktok_url": "TEXT",
-        "youtube_url": "TEXT",
-        "telegram_url": "TEXT",
-        "linkedin_url": "TEXT",
-        "github_url": "TEXT",
-        "facebook_url": "TEXT",
-        "kwai_url": "TEXT",
-        "mercadolivre_url": "TEXT",
-        "plan": "VARCHAR(20)",
-        "plan_status": "VARCHAR(20)",
-        "plan_started_at": "DATETIME",
-        "plan_expires_at": "DATETIME",
-        "last_paid_plan": "VARCHAR(20)",
-        "last_paid_expires_at": "DATETIME",
-        "mp_customer_id": "VARCHAR(120)",
-        "mp_subscription_id": "VARCHAR(120)",
-    }
-
-    product_cols: Dict[str, str] = {
-        "description": "TEXT",
-        "url": "VARCHAR(600)",
-        "image_url": "TEXT",
-        "source_image_url": "TEXT",
-        "price": "VARCHAR(50)",
-        "tag": "TEXT",
-        "badge": "TEXT",
-        "cta_label": "TEXT",
-        "created_at": "DATETIME",
-    }
-
     def table_exists(conn, table: str) -> bool:
-        row = conn.execute(
-            text("SELECT name FROM sqlite_master WHERE type='table' AND name=:t"),
-            {"t": table},
-        ).fetchone()
-        return row is not None
+        return conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=? LIMIT 1",
+            (table,),
+        ).first() is not None
 
-    def existing_cols(conn, table: str):
-        rows = conn.execute(text(f"PRAGMA table_info({table})")).fetchall()
-        return {r[1] for r in rows}
+    def existing_cols(conn, table: str) -> frozenset:
+        return frozenset(r[1] for r in conn.exec_driver_sql(f"PRAGMA table_info({table})"))
+
+    version = _schema_version()
+
+    with db_engine.begin() as conn:
+        if conn.exec_driver_sql("PRAGMA user_version").scalar() == version:
+            return
+
+        # o driver sqlite3 não abre transação sozinho para DDL
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+        # 🔥 PASSO 1 — CRIA TABELAS (ESSENCIAL)
+        Base.metadata.create_all(bind=conn)
 
-    with db_engine.connect() as conn:
         if table_exists(conn, "blacklink_users"):
             existing = existing_cols(conn, "blacklink_users")
-            for col, coltype in user_cols.items():
+            for col, coltype in USER_COLS.items():
                 if col not in existing:
                     conn.execute(
                         text(f"ALTER TABLE blacklink_users ADD COLUMN {col} {coltype}")
@@ -105,10 +214,13 @@ def ensure_sqlite_schema(db_engine) -> None:
 
         if table_exists(conn, "blacklink_products"):
             existing = existing_cols(conn, "blacklink_products")
-            for col, coltype in product_cols.items():
+            for col, coltype in PRODUCT_COLS.items():
                 if col not in existing:
                     conn.execute(
                         text(f"ALTER TABLE blacklink_products ADD COLUMN {col} {coltype}")
                     )
 
-        conn.commit()
+            for name, target in INDEXES.items():
+                conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+        conn.exec_driver_sql(f"PRAGMA user_version = {version}")
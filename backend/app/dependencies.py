@@ -1,14 +1,63 @@
 from __future__ import annotations
 
-from fastapi import HTTPException
-from app.config import PLAN_LIMITS
+from functools import lru_cache
 
+from fastapi import Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session
 
-def get_plan_limits(plan: str | None) -> dict:
+from app.config import PLAN_LIMITS, PlanLimit
+from app.database import get_db
+from app.models import BlackLinkUser
+
+# Mensagens de bloqueio montadas uma vez só.
+# Obs: a HTTPException em si é criada a cada raise — reaproveitar a mesma
+# instância acumularia __traceback__/__context__ entre requests.
+_AUTO_INGEST_DENIED = "Ingestão automática disponível apenas para planos PRO ou DON."
+_FEATURED_DENIED = "Destaque disponível apenas para planos PRO ou DON."
+
+
+@lru_cache(maxsize=32)
+def _product_limit_detail(plan_label: str, max_products: int) -> str:
+    return f"Limite atingido: plano {plan_label} permite até {max_products} produtos."
+
+
+def norm_username(username: str) -> str:
+    """
+    Depends(norm_username): entrega o {username} da rota já normalizado
+    (vira query param em rotas sem {username} no path).
+    """
+    return username.strip().lower()
+
+
+def get_user_by_username(
+    username: str = Depends(norm_username),
+    db: Session = Depends(get_db),
+) -> BlackLinkUser:
+    """
+    Depends(get_user_by_username): usuário do {username} da rota ou 404.
+    O FastAPI cacheia a dependência no request — um SELECT só, mesmo que
+    várias sub-dependências a peçam.
+    """
+    user = db.execute(
+        select(BlackLinkUser).where(BlackLinkUser.username == username)
+    ).scalar_one_or_none()
+
+    if not user:
+        raise HTTPException(status_code=404, detail="Usuário BlackLink não encontrado.")
+
+    return user
+
+
+def get_plan_limits(plan: str | None) -> PlanLimit:
     """
     Retorna a configuração do plano.
     Se vier algo inválido, assume FREE.
     """
+    # caminho rápido: valor do banco já canônico ("free" | "pro" | "don")
+    if plan in PLAN_LIMITS:
+        return PLAN_LIMITS[plan]
+
     p = (plan or "free").lower().strip()
     return PLAN_LIMITS.get(p, PLAN_LIMITS["free"])
 
@@ -21,7 +70,7 @@ def check_product_limit(plan: str | None, total_products: int) -> None:
     DON: ilimitado
     """
     limits = get_plan_limits(plan)
-    max_products = limits.get("max_products", 3)
+    max_products = limits.max_products
 
     if max_products is None:
         return  # ilimitado
@@ -29,7 +78,7 @@ def check_product_limit(plan: str | None, total_products: int) -> None:
     if total_products >= max_products:
         raise HTTPException(
             status_code=403,
-            detail=f"Limite atingido: plano {str(plan or 'free').upper()} permite até {max_products} produtos."
+            detail=_product_limit_detail(str(plan or "free").upper(), max_products),
         )
 
 
@@ -38,11 +87,8 @@ def require_auto_ingest(plan: str | None) -> None:
     Enforce: ingestão automática somente PRO/DON.
     """
     limits = get_plan_limits(plan)
-    if not limits.get("auto_ingest", False):
-        raise HTTPException(
-            status_code=403,
-            detail="Ingestão automática disponível apenas para planos PRO ou DON."
-        )
+    if not limits.auto_ingest:
+        raise HTTPException(status_code=403, detail=_AUTO_INGEST_DENIED)
 
 
 def require_featured_allowed(plan: str | None) -> None:
@@ -50,8 +96,5 @@ def require_featured_allowed(plan: str | None) -> None:
     Enforce: destaque (featured) somente PRO/DON.
     """
     limits = get_plan_limits(plan)
-    if not limits.get("featured_allowed", False):
-        raise HTTPException(
-            status_code=403,
-            detail="Destaque disponível apenas para planos PRO ou DON."
-        )
+    if not limits.featured_allowed:
+        raise HTTPException(status_code=403, detail=_FEATURED_DENIED)
@@ -1,12 +1,14 @@
 from __future__ import annotations
 
+import asyncio
 import logging
-from pathlib import Path
+from contextlib import asynccontextmanager, suppress
+from importlib.util import find_spec
+from typing import Dict
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 
 # ==================================================
 # LOG
@@ -15,16 +17,43 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("blacklink")
 
 # ==================================================
-# PATHS
+# CONFIG / TEMPLATES
 # ==================================================
-BASE_DIR = Path(__file__).resolve().parent
-TEMPLATES_DIR = BASE_DIR / "templates"
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
+from app.config import get_settings
+from app.templating import render, warm_templates
 
 # ==================================================
 # DATABASE
 # ==================================================
 from app.database import engine, ensure_sqlite_schema
+from app.services.link_guardian import run_link_guardian
+from app.routers.catalog import close_link_client
+
+# ==================================================
+# LIFESPAN (startup / shutdown)
+# ==================================================
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("🚀 Iniciando CosaNostra BlackLink")
+    settings = get_settings()
+    if settings.BLACKLINK_AUTO_MIGRATE or settings.ENV == "dev":
+        ensure_sqlite_schema(engine)
+        logger.info("✅ Banco de dados pronto")
+    else:
+        logger.info("⏭️ Migração automática desligada (BLACKLINK_AUTO_MIGRATE=0)")
+
+    logger.info(f"🧩 {warm_templates()} templates compilados")
+
+    guardian = asyncio.create_task(run_link_guardian())
+
+    yield
+
+    # espera o cancelamento terminar: o AsyncClient do guardian fecha antes do shutdown
+    guardian.cancel()
+    with suppress(asyncio.CancelledError):
+        await guardian
+
+    await close_link_client()
 
 # ==================================================
 # FASTAPI APP
@@ -35,6 +64,7 @@ app = FastAPI(
     openapi_url="/openapi.json",
     docs_url="/docs",
     redoc_url=None,
+    lifespan=lifespan,
 )
 
 # ==================================================
@@ -60,39 +90,38 @@ import app.routers.panel as panel
 import app.routers.payment as payment
 import app.routers.webhook as webhook
 
-try:
-    import app.routers.plan as plan
-    HAS_PLAN = True
-except Exception as e:
-    logger.warning(f"⚠️ Router plan indisponível: {e}")
-    HAS_PLAN = False
-
-app.include_router(auth.router, tags=["Auth"])
-app.include_router(product.router, tags=["Product"])
-app.include_router(blacklinks.router, tags=["BlackLink"])
-app.include_router(catalog.router, tags=["Catalog"])
-app.include_router(admin.router, tags=["Admin"])
-app.include_router(panel.router, tags=["Panel"])
-app.include_router(payment.router, tags=["Payment"])
-app.include_router(webhook.router, tags=["Webhook"])
+# router opcional: só é importado se o módulo existir no build
+HAS_PLAN = False
+if find_spec("app.routers.plan") is not None:
+    try:
+        import app.routers.plan as plan
+        HAS_PLAN = True
+    except Exception as e:
+        logger.warning(f"⚠️ Router plan indisponível: {e}")
+
+ROUTERS = [
+    (auth, "Auth"),
+    (product, "Product"),
+    (blacklinks, "BlackLink"),
+    (catalog, "Catalog"),
+    (admin, "Admin"),
+    (panel, "Panel"),
+    (payment, "Payment"),
+    (webhook, "Webhook"),
+]
 
 if HAS_PLAN:
-    app.include_router(plan.router, tags=["Plan"])
+    ROUTERS.append((plan, "Plan"))
 
-# ==================================================
-# STARTUP
-# ==================================================
-@app.on_event("startup")
-def on_startup():
-    logger.info("🚀 Iniciando CosaNostra BlackLink")
-    ensure_sqlite_schema(engine)
-    logger.info("✅ Banco de dados pronto")
+for mod, tag in ROUTERS:
+    app.include_router(mod.router, tags=[tag])
 
 # ==================================================
 # HEALTH
 # ==================================================
+# retorno tipado: o FastAPI serializa direto via pydantic (sem json.dumps)
 @app.get("/")
-def health():
+def health() -> Dict[str, str]:
     return {"status": "ok", "service": "blacklink"}
 
 # ==================================================
@@ -100,4 +129,4 @@ def health():
 # ==================================================
 @app.get("/ui", response_class=HTMLResponse)
 def ui_home(request: Request):
-    return templates.TemplateResponse("user_page.html", {"request": request})
+    return render("user_page.html", {"request": request})
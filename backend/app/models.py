@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 from datetime import datetime
+from typing import List, Optional
 
-from sqlalchemy import Column, DateTime, Integer, String, Text, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import DateTime, Index, Integer, String, Text, ForeignKey
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .database import Base
 
@@ -11,43 +12,42 @@ from .database import Base
 class BlackLinkUser(Base):
     __tablename__ = "blacklink_users"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
 
-    username = Column(String(50), unique=True, index=True, nullable=False)
-    display_name = Column(String(150), nullable=True)
-    bio = Column(Text, nullable=True)
+    username: Mapped[str] = mapped_column(String(50), unique=True, index=True, nullable=False)
+    display_name: Mapped[Optional[str]] = mapped_column(String(150), nullable=True)
+    bio: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
 
-    email = Column(String(180), nullable=True, unique=True)
+    email: Mapped[Optional[str]] = mapped_column(String(180), nullable=True, unique=True)
 
-    avatar_url = Column(Text, nullable=True)
+    avatar_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
 
-    main_cta_url = Column(Text, nullable=True)
-    main_cta_label = Column(Text, nullable=True)
-    main_cta_subtitle = Column(Text, nullable=True)
+    main_cta_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    main_cta_label: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    main_cta_subtitle: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
 
-    instagram_url = Column(Text, nullable=True)
-    tiktok_url = Column(Text, nullable=True)
-    youtube_url = Column(Text, nullable=True)
-    telegram_url = Column(Text, nullable=True)
-    linkedin_url = Column(Text, nullable=True)
-    github_url = Column(Text, nullable=True)
-    facebook_url = Column(Text, nullable=True)
-    kwai_url = Column(Text, nullable=True)
-    mercadolivre_url = Column(Text, nullable=True)
+    instagram_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    tiktok_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    youtube_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    telegram_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    linkedin_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    github_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    facebook_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    kwai_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    mercadolivre_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
 
-    plan = Column(String(20), default="free", nullable=False)
-    plan_status = Column(String(20), default="active", nullable=False)
-    plan_started_at = Column(DateTime, nullable=True)
-    plan_expires_at = Column(DateTime, nullable=True)
+    plan: Mapped[str] = mapped_column(String(20), default="free", nullable=False)
+    plan_status: Mapped[str] = mapped_column(String(20), default="active", nullable=False)
+    plan_started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    plan_expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
-    last_paid_plan = Column(String(20), nullable=True)
-    last_paid_expires_at = Column(DateTime, nullable=True)
+    last_paid_plan: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
+    last_paid_expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
-    mp_customer_id = Column(String(120), nullable=True)
-    mp_subscription_id = Column(String(120), nullable=True)
+    mp_customer_id: Mapped[Optional[str]] = mapped_column(String(120), nullable=True)
+    mp_subscription_id: Mapped[Optional[str]] = mapped_column(String(120), nullable=True)
 
-    products = relationship(
-        "BlackLinkProduct",
+    products: Mapped[List["BlackLinkProduct"]] = relationship(
         back_populates="owner",
         cascade="all, delete-orphan"
     )
@@ -55,27 +55,52 @@ class BlackLinkUser(Base):
 
 class BlackLinkProduct(Base):
     __tablename__ = "blacklink_products"
+    __table_args__ = (
+        # vitrine: owner_id + is_active (catálogo público)
+        Index("ix_products_owner_active", "owner_id", "is_active"),
+        # listagens do dono ordenadas por id
+        Index("ix_products_owner_id", "owner_id", "id"),
+        # varredura do link guardian: is_active = 1 AND id > :ultimo ORDER BY id
+        Index("ix_products_active_id", "is_active", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    owner_id: Mapped[int] = mapped_column(Integer, ForeignKey("blacklink_users.id"), nullable=False)
+
+    title: Mapped[str] = mapped_column(String(200), nullable=False)
+    description: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    url: Mapped[Optional[str]] = mapped_column(String(600), nullable=True)
+
+    image_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    source_image_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
 
-    id = Column(Integer, primary_key=True, index=True)
-    owner_id = Column(Integer, ForeignKey("blacklink_users.id"), nullable=False)
+    price: Mapped[Optional[str]] = mapped_column(String(50), nullable=True)
 
-    title = Column(String(200), nullable=False)
-    description = Column(Text, nullable=True)
+    tag: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    badge: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    cta_label: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
 
-    url = Column(String(600), nullable=True)
+    is_active: Mapped[Optional[int]] = mapped_column(Integer, default=1)
+    is_featured: Mapped[Optional[int]] = mapped_column(Integer, default=0)
 
-    image_url = Column(Text, nullable=True)
-    source_image_url = Column(Text, nullable=True)
+    # link guardian: varreduras seguidas com link morto (desativa ao chegar no limite)
+    dead_strike_count: Mapped[Optional[int]] = mapped_column(Integer, default=0)
+    last_dead_check_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
-    price = Column(String(50), nullable=True)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
 
-    tag = Column(Text, nullable=True)
-    badge = Column(Text, nullable=True)
-    cta_label = Column(Text, nullable=True)
+    owner: Mapped["BlackLinkUser"] = relationship(back_populates="products")
 
-    is_active = Column(Integer, default=1)
-    is_featured = Column(Integer, default=0)
 
-    created_at = Column(DateTime, default=datetime.utcnow)
+class ProcessedPayment(Base):
+    """
+    Pagamentos do Mercado Pago já aplicados pelo webhook (idempotência).
+    O UNIQUE em mp_payment_id é o "SET NX": duas entregas simultâneas do
+    mesmo pagamento não conseguem commitar as duas.
+    """
+    __tablename__ = "processed_payments"
 
-    owner = relationship("BlackLinkUser", back_populates="products")
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    mp_payment_id: Mapped[str] = mapped_column(String(64), unique=True, nullable=False)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
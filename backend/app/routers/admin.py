@@ -3,11 +3,12 @@ from __future__ import annotations
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import literal, select
 from sqlalchemy.orm import Session
 
 from app.database import get_db
 from app.models import BlackLinkUser
-from app.schemas import AdminCreateUser  # ✅ novo schema (JSON body)
+from app.schemas import AdminCreateUser, AdminCreateUserOut  # ✅ novo schema (JSON body)
 
 router = APIRouter(
     prefix="/admin",
@@ -18,14 +19,14 @@ router = APIRouter(
 # POST /admin/create-user
 # Criação profissional via JSON (SaaS padrão)
 # ============================================================
-@router.post("/create-user", status_code=201)
+@router.post("/create-user", status_code=201, response_model=AdminCreateUserOut)
 def create_user_admin(
     payload: AdminCreateUser,
     db: Session = Depends(get_db),
 ):
-    # normalização
-    username = (payload.username or "").strip().lower()
-    email = (payload.email or "").strip().lower()
+    # username/email já chegam normalizados (validator do schema)
+    username = payload.username
+    email = payload.email
     plan = (payload.plan or "free").lower().strip()
 
     # validações básicas
@@ -41,12 +42,12 @@ def create_user_admin(
             detail="Plano inválido. Use: free, pro ou don"
         )
 
-    # usuário já existe?
-    existing = db.query(BlackLinkUser).filter(
-        BlackLinkUser.username == username
-    ).first()
+    # usuário já existe? (SELECT 1 ... LIMIT 1 — não materializa a linha)
+    exists = db.execute(
+        select(literal(1)).where(BlackLinkUser.username == username).limit(1)
+    ).scalar()
 
-    if existing:
+    if exists:
         raise HTTPException(
             status_code=409,
             detail=f"Usuário '{username}' já existe"
@@ -60,14 +61,16 @@ def create_user_admin(
         plan_status="active",
     )
 
+    # flush = INSERT ... RETURNING id; resposta montada antes do commit
     db.add(user)
-    db.commit()
-    db.refresh(user)
-
-    return {
+    db.flush()
+    out = {
         "id": user.id,
         "username": user.username,
         "email": user.email,
         "plan": user.plan,
         "status": "created"
     }
+    db.commit()
+
+    return out
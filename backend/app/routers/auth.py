@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from ..database import get_db
+from ..dependencies import get_user_by_username, norm_username
 from ..models import BlackLinkUser
 from ..schemas import UserOut
 
@@ -14,17 +16,15 @@ router = APIRouter(prefix="/auth", tags=["Auth"])
 # ============================================================
 
 @router.post("/login", response_model=UserOut)
-def login_blacklink(username: str, db: Session = Depends(get_db)):
+def login_blacklink(username: str = Depends(norm_username), db: Session = Depends(get_db)):
     """
     Login simples para painel/admin.
     Retorna o usuário se existir.
     """
 
-    user = (
-        db.query(BlackLinkUser)
-        .filter(BlackLinkUser.username == username.lower().strip())
-        .first()
-    )
+    user = db.execute(
+        select(BlackLinkUser).where(BlackLinkUser.username == username)
+    ).scalar_one_or_none()
 
     if not user:
         raise HTTPException(
@@ -36,21 +36,9 @@ def login_blacklink(username: str, db: Session = Depends(get_db)):
 
 
 @router.get("/me/{username}", response_model=UserOut)
-def get_me(username: str, db: Session = Depends(get_db)):
+def get_me(user: BlackLinkUser = Depends(get_user_by_username)):
     """
     Endpoint utilitário para painel.
     """
 
-    user = (
-        db.query(BlackLinkUser)
-        .filter(BlackLinkUser.username == username.lower().strip())
-        .first()
-    )
-
-    if not user:
-        raise HTTPException(
-            status_code=404,
-            detail="Usuário BlackLink não encontrado."
-        )
-
     return user
@@ -1,25 +1,23 @@
 from __future__ import annotations
 
 from typing import List, Optional
-from pathlib import Path
 from datetime import datetime
-from dateutil.parser import isoparse
+from operator import attrgetter
 
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy import literal, select
+from sqlalchemy.orm import Session, selectinload
 
 from app.database import get_db
+from app.dependencies import norm_username
 from app import models, schemas
 from app.services.plan_manager import sync_user_plan
+from app.services.product_cache import invalidate_product_url, invalidate_products
+from app.templating import cache_headers, make_etag, not_modified, render
 
 router = APIRouter(tags=["BlackLink"])
 
-BASE_DIR = Path(__file__).resolve().parent.parent
-TEMPLATES_DIR = BASE_DIR / "templates"
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
-
 
 # --------------------------------------------------
 # UTILS
@@ -29,15 +27,35 @@ def _parse_dt(value: Optional[str]) -> Optional[datetime]:
         return None
     if isinstance(value, datetime):
         return value
-    return isoparse(value)
-
-
-def _get_user_by_username(db: Session, username: str) -> models.BlackLinkUser:
-    username = username.lower().strip()
-    user = db.query(models.BlackLinkUser).filter(models.BlackLinkUser.username == username).first()
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+
+def _load_user(db: Session, username: str, *options) -> models.BlackLinkUser:
+    """
+    `options` são loader options repassados ao SELECT
+    (ex.: selectinload(models.BlackLinkUser.products)).
+    `username` já normalizado (norm_username).
+    """
+    user = db.execute(
+        select(models.BlackLinkUser)
+        .where(models.BlackLinkUser.username == username)
+        .options(*options)
+    ).scalar_one_or_none()
     if not user:
         raise HTTPException(status_code=404, detail="Usuário BlackLink não encontrado.")
-    return sync_user_plan(db, user)
+    return user
+
+
+def _get_user_readonly(db: Session, username: str, *options) -> models.BlackLinkUser:
+    # GETs: plano sincronizado só em memória (transação continua só leitura)
+    return sync_user_plan(db, _load_user(db, username, *options), persist=False)
+
+
+def _get_user_mutating(db: Session, username: str, *options) -> models.BlackLinkUser:
+    # PATCH/DELETE: grava o downgrade de plano expirado junto
+    return sync_user_plan(db, _load_user(db, username, *options))
 
 
 # --------------------------------------------------
@@ -45,8 +63,11 @@ def _get_user_by_username(db: Session, username: str) -> models.BlackLinkUser:
 # --------------------------------------------------
 @router.post("/blacklink/", response_model=schemas.UserOut)
 def create_blacklink_user(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
-    username = user_in.username.lower().strip()
-    if db.query(models.BlackLinkUser).filter(models.BlackLinkUser.username == username).first():
+    username = user_in.username  # normalizado no schema
+    taken = db.execute(
+        select(literal(1)).where(models.BlackLinkUser.username == username).limit(1)
+    ).scalar()
+    if taken:
         raise HTTPException(status_code=400, detail="Username já está em uso.")
 
     data = user_in.model_dump()
@@ -65,13 +86,18 @@ def create_blacklink_user(user_in: schemas.UserCreate, db: Session = Depends(get
 
 
 @router.get("/blacklink/{username}", response_model=schemas.UserOut)
-def get_blacklink_user(username: str, db: Session = Depends(get_db)):
-    return _get_user_by_username(db, username)
+def get_blacklink_user(username: str = Depends(norm_username), db: Session = Depends(get_db)):
+    # UserOut serializa `products`
+    return _get_user_readonly(db, username, selectinload(models.BlackLinkUser.products))
 
 
 @router.patch("/blacklink/{username}", response_model=schemas.UserOut)
-def update_blacklink_user(username: str, user_update: schemas.UserUpdate, db: Session = Depends(get_db)):
-    user = _get_user_by_username(db, username)
+def update_blacklink_user(
+    user_update: schemas.UserUpdate,
+    username: str = Depends(norm_username),
+    db: Session = Depends(get_db),
+):
+    user = _get_user_mutating(db, username)
     data = user_update.model_dump(exclude_unset=True)
 
     # 🔥 FIX PASSO 3 — converter datas
@@ -85,62 +111,79 @@ def update_blacklink_user(username: str, user_update: schemas.UserUpdate, db: Se
     for field, value in data.items():
         setattr(user, field, value)
 
-    db.add(user)
+    # serializa antes do commit (sem refresh): só `products` é carregado
+    out = schemas.UserOut.model_validate(user)
     db.commit()
-    db.refresh(user)
-    return user
+    return out
 
 
 @router.get("/blacklink/", response_model=List[schemas.UserOut])
 def list_blacklink_users(plan: Optional[str] = None, db: Session = Depends(get_db)):
-    q = db.query(models.BlackLinkUser)
+    # UserOut serializa `products`: selectin evita 1 SELECT por usuário
+    q = db.query(models.BlackLinkUser).options(selectinload(models.BlackLinkUser.products))
     if plan:
         q = q.filter(models.BlackLinkUser.plan == plan)
     return q.all()
 
 
 @router.delete("/blacklink/{username}", status_code=204)
-def delete_blacklink_user(username: str, db: Session = Depends(get_db)):
-    user = _get_user_by_username(db, username)
+def delete_blacklink_user(username: str = Depends(norm_username), db: Session = Depends(get_db)):
+    user = _get_user_mutating(db, username)
+    # o cascade já carrega os produtos para apagá-los
+    product_ids = [p.id for p in user.products]
     db.delete(user)
     db.commit()
+    invalidate_products(user.id)
+    for product_id in product_ids:
+        invalidate_product_url(product_id)
     return None
 
 
 # --------------------------------------------------
 # PÁGINA PÚBLICA
 # --------------------------------------------------
+# campos do usuário expostos no template (mesma chave = mesmo atributo)
+_PUBLIC_FIELDS = (
+    "username",
+    "display_name",
+    "bio",
+    "avatar_url",
+    "main_cta_url",
+    "main_cta_label",
+    "main_cta_subtitle",
+    "instagram_url",
+    "tiktok_url",
+    "youtube_url",
+    "telegram_url",
+    "linkedin_url",
+    "github_url",
+    "facebook_url",
+    "kwai_url",
+    "mercadolivre_url",
+    "plan",
+    "plan_status",
+)
+_get_public_fields = attrgetter(*_PUBLIC_FIELDS)
+
+# colunas do produto que entram no ETag da página pública
+_get_product_etag_fields = attrgetter(
+    *(c.key for c in models.BlackLinkProduct.__table__.columns)
+)
+
+
 @router.get("/u/{username}", response_class=HTMLResponse)
-def public_blacklink_page(username: str, request: Request, db: Session = Depends(get_db)):
-    user = _get_user_by_username(db, username)
-    products = (
-        db.query(models.BlackLinkProduct)
-        .filter(models.BlackLinkProduct.owner_id == user.id)
-        .all()
-    )
-
-    return templates.TemplateResponse(
-        "blacklink_don.html",
-        {
-            "request": request,
-            "username": user.username,
-            "display_name": user.display_name,
-            "bio": user.bio,
-            "avatar_url": user.avatar_url,
-            "main_cta_url": user.main_cta_url,
-            "main_cta_label": user.main_cta_label,
-            "main_cta_subtitle": user.main_cta_subtitle,
-            "instagram_url": user.instagram_url,
-            "tiktok_url": user.tiktok_url,
-            "youtube_url": user.youtube_url,
-            "telegram_url": user.telegram_url,
-            "linkedin_url": user.linkedin_url,
-            "github_url": user.github_url,
-            "facebook_url": user.facebook_url,
-            "kwai_url": user.kwai_url,
-            "mercadolivre_url": user.mercadolivre_url,
-            "products": products,
-            "plan": user.plan,
-            "plan_status": user.plan_status,
-        },
-    )
+def public_blacklink_page(request: Request, username: str = Depends(norm_username), db: Session = Depends(get_db)):
+    # usuário + produtos carregados juntos (selectin), sem lazy load no template
+    user = _get_user_readonly(db, username, selectinload(models.BlackLinkUser.products))
+    products = user.products
+
+    public_values = _get_public_fields(user)
+    etag = make_etag(public_values, [_get_product_etag_fields(p) for p in products])
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    context = dict(zip(_PUBLIC_FIELDS, public_values))
+    context["request"] = request
+    context["products"] = products
+    return render("blacklink_don.html", context, headers=cache_headers(etag))
@@ -1,20 +1,30 @@
 from __future__ import annotations
 
+import asyncio
 import re
-from typing import List, Optional
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 
 import httpx
+import orjson
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from ..config import TEMPLATES_DIR
 from ..database import get_db
-from .. import models
+from ..dependencies import norm_username
+from .. import models, schemas
+from ..services.product_cache import (
+    get_product_url,
+    get_products_json,
+    set_product_url,
+    set_products_json,
+)
+from ..templating import cache_headers, make_etag, not_modified, render
 
 router = APIRouter(tags=["Catalog"])
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 
 
 # ============================================================
@@ -22,15 +32,13 @@ templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 # ============================================================
 
 def _get_or_create_user(db: Session, username: str) -> models.BlackLinkUser:
-    username = (username or "").lower().strip()
+    # `username` já normalizado (norm_username)
     if not username:
         raise HTTPException(status_code=400, detail="Username inválido.")
 
-    user = (
-        db.query(models.BlackLinkUser)
-        .filter(models.BlackLinkUser.username == username)
-        .first()
-    )
+    user = db.execute(
+        select(models.BlackLinkUser).where(models.BlackLinkUser.username == username)
+    ).scalar_one_or_none()
 
     if not user:
         user = models.BlackLinkUser(
@@ -50,67 +58,119 @@ def _get_or_create_user(db: Session, username: str) -> models.BlackLinkUser:
 # Helpers — Products
 # ============================================================
 
+# compilado uma vez no import (roda N vezes por listagem)
+_PRICE_RE = re.compile(r"(\d{1,3}(?:[.\s]\d{3})*(?:[.,]\d{2})|\d+(?:[.,]\d{2})?)")
+
+
 def _parse_price_from_badge(badge: Optional[str]) -> str:
     if not badge:
         return ""
 
-    s = badge.strip()
-    m = re.search(
-        r"(\d{1,3}(?:[.\s]\d{3})*(?:[.,]\d{2})|\d+(?:[.,]\d{2})?)",
-        s,
-    )
+    m = _PRICE_RE.search(badge.strip())
     if not m:
         return ""
 
     return m.group(1).replace(" ", "")
 
 
-def _safe_image_url(product: models.BlackLinkProduct) -> str:
-    url = getattr(product, "source_image_url", None)
+def _safe_image_url(product) -> str:
+    url = product.source_image_url
     if url:
         return url
     return "/assets/CosaNostraAI.ico"
 
 
-def _is_link_alive(url: str) -> bool:
+# cliente único (pool de conexões reaproveitado entre requests);
+# criado sob demanda para um novo lifespan não herdar o cliente já fechado
+_ASYNC: Optional[httpx.AsyncClient] = None
+
+
+def _link_client() -> httpx.AsyncClient:
+    global _ASYNC
+    if _ASYNC is None or _ASYNC.is_closed:
+        _ASYNC = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=3.0,
+            limits=httpx.Limits(max_connections=50),
+        )
+    return _ASYNC
+
+
+async def close_link_client() -> None:
+    """
+    Fecha o pool do cliente de checagem (chamado no shutdown do lifespan).
+    """
+    if _ASYNC is not None:
+        await _ASYNC.aclose()
+
+# fallback quando o servidor recusa HEAD (405); 200 ou 206 = vivo
+_PROBE_HEADERS = {"User-Agent": "Mozilla/5.0", "Range": "bytes=0-0"}
+
+# url -> (expira_em, vivo), em ordem de uso (LRU)
+# sem lock: só é acessado do event loop
+_ALIVE_CACHE: "OrderedDict[str, Tuple[float, bool]]" = OrderedDict()
+_ALIVE_TTL_SECONDS = 600
+_ALIVE_CACHE_MAX = 10_000
+
+
+async def _is_link_alive(url: str) -> bool:
     if not url:
         return False
 
     if "mercadolivre.com" not in url and "mercadolivre.com.br" not in url:
         return True
 
+    url = url.strip()
+    now = time.monotonic()
+    hit = _ALIVE_CACHE.get(url)
+    if hit and hit[0] > now:
+        _ALIVE_CACHE.move_to_end(url)
+        return hit[1]
+
+    client = _link_client()
     try:
-        with httpx.Client(follow_redirects=True, timeout=3.0) as client:
-            resp = client.head(url)
-            if resp.status_code == 405:
-                resp = client.get(url, headers={"User-Agent": "Mozilla/5.0"})
+        resp = await client.head(url)
+        if resp.status_code == 405:
+            # GET de 1 byte em stream: só o status interessa, não o HTML
+            async with client.stream("GET", url, headers=_PROBE_HEADERS) as resp:
+                pass
 
-        if resp.status_code in (404, 410):
-            return False
+        alive = resp.status_code not in (404, 410)
 
-        if resp.history and resp.status_code in (404, 410):
-            return False
+    except httpx.RequestError:
+        return True  # falha de rede não derruba o produto (nem vai pro cache)
 
-        return True
+    _ALIVE_CACHE[url] = (now + _ALIVE_TTL_SECONDS, alive)
+    _ALIVE_CACHE.move_to_end(url)
+    if len(_ALIVE_CACHE) > _ALIVE_CACHE_MAX:
+        _ALIVE_CACHE.popitem(last=False)  # descarta o menos usado
 
-    except httpx.RequestError:
-        return True
+    return alive
+
+
+# só o que _product_to_viewmodel lê: Row em vez de objeto ORM hidratado
+_VM_COLUMNS = (
+    models.BlackLinkProduct.id,
+    models.BlackLinkProduct.title,
+    models.BlackLinkProduct.badge,
+    models.BlackLinkProduct.source_image_url,
+    models.BlackLinkProduct.url,
+)
 
 
 def _base_queryset_products(
-    db: Session,
     owner_id: int,
     q: Optional[str],
     order_by: str,
     direction: str,
 ):
-    query = db.query(models.BlackLinkProduct).filter(
+    query = select(*_VM_COLUMNS).where(
         models.BlackLinkProduct.owner_id == owner_id,
         models.BlackLinkProduct.is_active == 1
     )
 
     if q:
-        query = query.filter(models.BlackLinkProduct.title.ilike(f"%{q}%"))
+        query = query.where(models.BlackLinkProduct.title.ilike(f"%{q}%"))
 
     if order_by == "title":
         sort_field = models.BlackLinkProduct.title
@@ -125,7 +185,13 @@ def _base_queryset_products(
     return query.order_by(sort_field)
 
 
-def _product_to_viewmodel(product: models.BlackLinkProduct) -> dict:
+def _fetch_all(db: Session, query) -> list:
+    # SELECT + fetch inteiros na thread (chamado via asyncio.to_thread)
+    return db.execute(query).all()
+
+
+def _product_to_viewmodel(product) -> dict:
+    # aceita BlackLinkProduct ou Row de _VM_COLUMNS
     return {
         "id": product.id,
         "title": product.title,                    # 🔥 alinhado ao template
@@ -145,22 +211,40 @@ def _product_to_viewmodel(product: models.BlackLinkProduct) -> dict:
     response_class=HTMLResponse,
     name="user_products",
 )
-def user_products_page(
-    username: str,
+async def user_products_page(
     request: Request,
+    username: str = Depends(norm_username),
     q: Optional[str] = Query(default=None),
     order_by: str = Query(default="id", pattern="^(id|title|badge)$"),
     direction: str = Query(default="desc", pattern="^(asc|desc)$"),
     db: Session = Depends(get_db),
 ):
-    user = _get_or_create_user(db, username)
-
-    products_db: List[models.BlackLinkProduct] = (
-        _base_queryset_products(db, user.id, q, order_by, direction).all()
-    )
-
-    alive_products = [p for p in products_db if _is_link_alive(p.url or "")]
-    products_vm = [_product_to_viewmodel(p) for p in alive_products]
+    # handlers async: todo acesso à Session sync vai para uma thread
+    # (como no webhook), o event loop só espera os HEADs
+    def load():
+        user = _get_or_create_user(db, username)
+        rows = db.execute(
+            _base_queryset_products(user.id, q, order_by, direction)
+        ).all()
+        return user, rows
+
+    user, products_db = await asyncio.to_thread(load)
+
+    # HEADs em paralelo (e cacheados) em vez de um por vez
+    alive = await asyncio.gather(*(_is_link_alive(p.url or "") for p in products_db))
+
+    # ETag depois das checagens: link que morreu muda a página (e a ETag)
+    # mesmo sem nenhuma linha alterada no banco; o 304 ainda economiza o render
+    etag = make_etag(user.plan, q, order_by, direction, [tuple(p) for p in products_db], alive)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    products_vm = [
+        _product_to_viewmodel(p)
+        for p, ok in zip(products_db, alive)
+        if ok
+    ]
 
     # 🔥 CONTEXT COMPLETO (ESSENCIAL PARA O TEMPLATE)
     context = {
@@ -173,7 +257,7 @@ def user_products_page(
         "direction": direction,
     }
 
-    return templates.TemplateResponse("user_products.html", context)
+    return render("user_products.html", context, headers=cache_headers(etag))
 
 
 # ============================================================
@@ -181,49 +265,60 @@ def user_products_page(
 # /blacklink/{username}/produto/{product_id}
 # ============================================================
 
+# "outros produtos" exibidos no detalhe
+_OTHERS_LIMIT = 3
+_OTHERS_PAGE = 10  # folga para links mortos
+
 @router.get(
     "/blacklink/{username}/produto/{product_id}",
     response_class=HTMLResponse,
     name="user_product_detail",
 )
-def product_detail_page(
-    username: str,
+async def product_detail_page(
     product_id: int,
     request: Request,
+    username: str = Depends(norm_username),
     db: Session = Depends(get_db),
 ):
-    user = _get_or_create_user(db, username)
+    def load():
+        user = _get_or_create_user(db, username)
+        return user, db.get(models.BlackLinkProduct, product_id)
 
-    product = (
-        db.query(models.BlackLinkProduct)
-        .filter(models.BlackLinkProduct.id == product_id)
-        .first()
-    )
+    user, product = await asyncio.to_thread(load)
 
     if not product or product.owner_id != user.id:
         raise HTTPException(status_code=404, detail="Produto não encontrado.")
 
-    if not _is_link_alive(product.url or ""):
+    if not await _is_link_alive(product.url or ""):
         raise HTTPException(status_code=404, detail="Produto indisponível.")
 
     product_vm = _product_to_viewmodel(product)
 
-    others_db = (
-        db.query(models.BlackLinkProduct)
-        .filter(
+    others_query = (
+        select(*_VM_COLUMNS)
+        .where(
             models.BlackLinkProduct.owner_id == user.id,
             models.BlackLinkProduct.id != product_id,
             models.BlackLinkProduct.is_active == 1,
         )
         .order_by(models.BlackLinkProduct.id.desc())
-        .all()
+        .limit(_OTHERS_PAGE)
     )
 
-    others_vm = [
-        _product_to_viewmodel(p)
-        for p in others_db
-        if _is_link_alive(p.url or "")
-    ][:3]
+    # páginas de _OTHERS_PAGE linhas (links checados em paralelo);
+    # para assim que houver _OTHERS_LIMIT vivos
+    others_vm = []
+    offset = 0
+    while len(others_vm) < _OTHERS_LIMIT:
+        page = await asyncio.to_thread(_fetch_all, db, others_query.offset(offset))
+        if not page:
+            break
+        alive = await asyncio.gather(*(_is_link_alive(p.url or "") for p in page))
+        others_vm.extend(_product_to_viewmodel(p) for p, ok in zip(page, alive) if ok)
+        if len(page) < _OTHERS_PAGE:
+            break
+        offset += _OTHERS_PAGE
+    others_vm = others_vm[:_OTHERS_LIMIT]
 
     context = {
         "request": request,
@@ -233,7 +328,7 @@ def product_detail_page(
         "others": others_vm,
     }
 
-    return templates.TemplateResponse("product_detail.html", context)
+    return render("product_detail.html", context)
 
 
 # ============================================================
@@ -246,46 +341,59 @@ def product_detail_page(
     response_class=RedirectResponse,
     name="product_out",
 )
-def product_out(product_id: int, db: Session = Depends(get_db)):
-    product = (
-        db.query(models.BlackLinkProduct)
-        .filter(models.BlackLinkProduct.id == product_id)
-        .first()
-    )
+async def product_out(product_id: int, db: Session = Depends(get_db)):
+    # clique de afiliado: URL em cache, sem SELECT no caminho quente
+    url = get_product_url(product_id)
+    if url is None:
+        url = await asyncio.to_thread(
+            db.scalar,
+            select(models.BlackLinkProduct.url)
+            .where(models.BlackLinkProduct.id == product_id),
+        )
+        set_product_url(product_id, url)
 
-    if not product or not _is_link_alive(product.url or ""):
+    if not url or not await _is_link_alive(url):
         raise HTTPException(status_code=404, detail="Produto indisponível.")
 
-    return RedirectResponse(url=product.url)
+    # 307 + cache curto no navegador: cliques repetidos nem chegam aqui
+    return RedirectResponse(
+        url=url,
+        status_code=307,
+        headers={"Cache-Control": "private, max-age=60"},
+    )
 
 
 # ============================================================
 # API JSON (opcional)
 # ============================================================
 
-@router.get("/api/blacklink/{username}/products", response_class=JSONResponse)
-def api_list_user_products(username: str, db: Session = Depends(get_db)):
+# campos expostos pela API = campos de ProductListItem (mesma ordem no JSON)
+_API_COLUMNS = tuple(
+    getattr(models.BlackLinkProduct, name)
+    for name in schemas.ProductListItem.model_fields
+)
+
+
+# response_model só documenta o schema: o corpo sai direto do orjson
+@router.get(
+    "/api/blacklink/{username}/products",
+    response_model=List[schemas.ProductListItem],
+    response_class=JSONResponse,
+)
+def api_list_user_products(username: str = Depends(norm_username), db: Session = Depends(get_db)):
     user = _get_or_create_user(db, username)
 
-    products = (
-        db.query(models.BlackLinkProduct)
-        .filter(models.BlackLinkProduct.owner_id == user.id)
+    # JSON já serializado (invalidado pelo router /product)
+    body = get_products_json(user.id)
+    if body is not None:
+        return Response(content=body, media_type="application/json")
+
+    rows = db.execute(
+        select(*_API_COLUMNS)
+        .where(models.BlackLinkProduct.owner_id == user.id)
         .order_by(models.BlackLinkProduct.id.desc())
-        .all()
-    )
+    ).all()
 
-    return JSONResponse(
-        content=[
-            {
-                "id": p.id,
-                "owner_id": p.owner_id,
-                "title": p.title,
-                "description": p.description,
-                "url": p.url,
-                "tag": p.tag,
-                "badge": p.badge,
-                "cta_label": p.cta_label,
-            }
-            for p in products
-        ]
-    )
+    body = orjson.dumps([row._asdict() for row in rows])
+    set_products_json(user.id, body)
+    return Response(content=body, media_type="application/json")
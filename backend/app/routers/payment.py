@@ -1,33 +1,26 @@
 from __future__ import annotations
 
+import hmac
 from datetime import datetime, timezone
 from typing import Optional
 
-import mercadopago
 from fastapi import APIRouter, Depends, HTTPException, Header
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from app.database import get_db
 from app import models
 from app.config import settings
 from app.schemas import PaymentProcessRequest, PaymentProcessResponse
+from app.services.mp_client import get_mp_sdk
 from app.services.plan_catalog import (
     get_plan,
     normalize_plan,
     calc_plan_expiry,
+    total_price_brl,
     PLAN_FREE,
 )
-
-# ============================================================
-# 🔐 BLINDAGEM — MERCADO PAGO SDK
-# ============================================================
-
-MP_ACCESS_TOKEN = (settings.MP_ACCESS_TOKEN or "").strip()
-
-if not MP_ACCESS_TOKEN:
-    raise RuntimeError("❌ MP_ACCESS_TOKEN não definido ou inválido")
-
-sdk = mercadopago.SDK(MP_ACCESS_TOKEN)
+from app.services.plan_manager import is_expired
 
 # ============================================================
 # ROUTER
@@ -52,11 +45,13 @@ def apply_plan_upgrade(
 
     now = datetime.now(timezone.utc)
 
+    # plan_expires_at volta do banco sem tz (coluna DateTime naive, em UTC):
+    # is_expired normaliza antes de comparar com o `now` aware
     if (
         user.plan in ("pro", "don")
         and user.plan_status == "active"
         and user.plan_expires_at
-        and user.plan_expires_at > now
+        and not is_expired(user.plan_expires_at, now=now)
     ):
         start_at = user.plan_expires_at
     else:
@@ -102,11 +97,9 @@ def create_checkout_preference(
     if not plan.is_sellable:
         raise HTTPException(status_code=400, detail="Plano inválido")
 
-    user = (
-        db.query(models.BlackLinkUser)
-        .filter(models.BlackLinkUser.username == username)
-        .first()
-    )
+    user = db.execute(
+        select(models.BlackLinkUser).where(models.BlackLinkUser.username == username)
+    ).scalar_one_or_none()
 
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
@@ -123,7 +116,7 @@ def create_checkout_preference(
             detail="URLs do Mercado Pago não configuradas",
         )
 
-    unit_price = (plan.price_brl_cents / 100) * months
+    unit_price = total_price_brl(plan, months)
 
     preference_data = {
         "items": [
@@ -131,7 +124,7 @@ def create_checkout_preference(
                 "title": f"Plano {plan.name} — {months} mês(es)",
                 "quantity": 1,
                 "currency_id": "BRL",
-                "unit_price": float(unit_price),
+                "unit_price": unit_price,
             }
         ],
         "payer": {
@@ -147,7 +140,7 @@ def create_checkout_preference(
         "auto_return": "approved",
     }
 
-    preference = sdk.preference().create(preference_data)
+    preference = get_mp_sdk().preference().create(preference_data)
 
     if preference.get("status") not in (200, 201):
         raise HTTPException(
@@ -186,11 +179,9 @@ def process_payment(
     if plan_id == PLAN_FREE:
         raise HTTPException(status_code=400, detail="Plano FREE não é vendável")
 
-    user = (
-        db.query(models.BlackLinkUser)
-        .filter(models.BlackLinkUser.username == username)
-        .first()
-    )
+    user = db.execute(
+        select(models.BlackLinkUser).where(models.BlackLinkUser.username == username)
+    ).scalar_one_or_none()
 
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
@@ -202,10 +193,12 @@ def process_payment(
             raise HTTPException(400, "payment_id obrigatório")
 
         if settings.MP_WEBHOOK_SECRET:
-            if x_webhook_secret != settings.MP_WEBHOOK_SECRET:
+            if not x_webhook_secret or not hmac.compare_digest(
+                x_webhook_secret.encode(), settings.MP_WEBHOOK_SECRET.encode()
+            ):
                 raise HTTPException(403, "Webhook não autorizado")
 
-        payment = sdk.payment().get(payload.payment_id)
+        payment = get_mp_sdk().payment().get(payload.payment_id)
 
         if payment.get("status") != 200:
             raise HTTPException(400, "Pagamento não encontrado")
@@ -225,11 +218,9 @@ def process_payment(
         months=months,
     )
 
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-
-    return PaymentProcessResponse(
+    # resposta montada antes do commit: os campos já estão em memória e o
+    # commit expiraria o usuário (sem refresh = sem SELECT extra de recarga)
+    response = PaymentProcessResponse(
         status="approved",
         message="Plano ativado com sucesso",
         username=user.username,
@@ -237,3 +228,6 @@ def process_payment(
         plan_status=user.plan_status,
         plan_expires_at=user.plan_expires_at,
     )
+    db.commit()
+
+    return response
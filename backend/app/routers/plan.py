@@ -7,8 +7,10 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 
 from app.database import get_db
+from app.dependencies import get_user_by_username
 from app.models import BlackLinkUser
 from app.schemas import UserOut
+from app.services.plan_manager import sync_user_plan
 
 router = APIRouter(
     prefix="/plan",
@@ -58,16 +60,11 @@ def _validate_plan(plan: str) -> None:
 # ============================================================
 @router.get("/{username}")
 def get_user_plan(
-    username: str,
+    user: BlackLinkUser = Depends(get_user_by_username),
     db: Session = Depends(get_db),
 ):
-    user = (
-        db.query(BlackLinkUser)
-        .filter(BlackLinkUser.username == username)
-        .first()
-    )
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    # leitura: downgrade de plano vencido só em memória
+    sync_user_plan(db, user, persist=False)
 
     return {
         "username": user.username,
@@ -85,28 +82,23 @@ def get_user_plan(
 # ============================================================
 @router.post("/upgrade/{username}", response_model=UserOut)
 def upgrade_plan(
-    username: str,
     plan: str = Query(..., description="Plano desejado: pro | don"),
     months: Optional[int] = Query(1, ge=1, le=36),
+    user: BlackLinkUser = Depends(get_user_by_username),
     db: Session = Depends(get_db),
 ):
     plan = _normalize_plan(plan)
     _validate_plan(plan)
 
+    # plano vencido vira FREE antes das regras (gravado no commit do upgrade)
+    sync_user_plan(db, user, persist=False)
+
     if not PLANS[plan]["sellable"]:
         raise HTTPException(
             status_code=400,
             detail="Plano FREE não pode ser adquirido via upgrade",
         )
 
-    user = (
-        db.query(BlackLinkUser)
-        .filter(BlackLinkUser.username == username)
-        .first()
-    )
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     # 🔒 Regras de negócio
     if user.plan == "don":
         raise HTTPException(
@@ -133,8 +125,9 @@ def upgrade_plan(
     user.plan_started_at = now
     user.plan_expires_at = None  # pode ser controlado depois por pagamento real
 
-    db.add(user)
+    # serializa antes do commit: os valores já estão em memória e o commit
+    # expiraria o usuário (sem refresh = sem SELECT extra de recarga)
+    out = UserOut.model_validate(user)
     db.commit()
-    db.refresh(user)
 
-    return user
+    return out
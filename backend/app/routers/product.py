@@ -1,9 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 from app.database import get_db
 from app.models import BlackLinkProduct, BlackLinkUser
+from app.dependencies import get_user_by_username, norm_username
+from app.services.plan_manager import is_expired
+from app.services.product_cache import (
+    invalidate_product_url,
+    invalidate_products,
+    set_product_url,
+)
 from app.schemas import (
     ProductCreate,
     ProductUpdate,
@@ -25,43 +33,50 @@ PLAN_PRODUCT_LIMITS = {
 }
 
 
-def check_product_limit(user: BlackLinkUser, db: Session):
-    plan = (user.plan or "free").lower()
+# total de produtos do dono, correlacionado à linha do usuário
+_PRODUCT_COUNT = (
+    select(func.count(BlackLinkProduct.id))
+    .where(BlackLinkProduct.owner_id == BlackLinkUser.id)
+    .correlate(BlackLinkUser)
+    .scalar_subquery()
+)
+
+
+# detalhe do 403 por plano, montado uma vez no import
+_LIMIT_DETAILS = {
+    # 🎯 MENSAGEM DE UPGRADE
+    "free": {
+        "error": "product_limit_reached",
+        "message": (
+            "Você atingiu o limite de 3 produtos do plano FREE. "
+            "Faça upgrade para o plano PRO e libere até 20 produtos."
+        ),
+        "current_plan": "FREE",
+        "suggested_plan": "PRO",
+        "upgrade_required": True
+    },
+    **{
+        plan: f"Limite de produtos atingido para o plano {plan.upper()} ({limit})"
+        for plan, limit in PLAN_PRODUCT_LIMITS.items()
+        if plan != "free" and limit is not None
+    },
+}
+
+
+def check_product_limit(plan: Optional[str], total_products: int):
+    plan = (plan or "free").lower()
     limit = PLAN_PRODUCT_LIMITS.get(plan, 3)
 
-    # DON = ilimitado
-    if limit is None:
+    # DON = ilimitado; abaixo do limite = caminho comum
+    if limit is None or total_products < limit:
         return
 
-    total_products = (
-        db.query(BlackLinkProduct)
-        .filter(BlackLinkProduct.owner_id == user.id)
-        .count()
+    raise HTTPException(
+        status_code=403,
+        detail=_LIMIT_DETAILS.get(plan)
+        or f"Limite de produtos atingido para o plano {plan.upper()} ({limit})",
     )
 
-    if total_products >= limit:
-        # 🎯 MENSAGEM DE UPGRADE
-        if plan == "free":
-            raise HTTPException(
-                status_code=403,
-                detail={
-                    "error": "product_limit_reached",
-                    "message": (
-                        "Você atingiu o limite de 3 produtos do plano FREE. "
-                        "Faça upgrade para o plano PRO e libere até 20 produtos."
-                    ),
-                    "current_plan": "FREE",
-                    "suggested_plan": "PRO",
-                    "upgrade_required": True
-                }
-            )
-
-        # fallback (PRO atingiu limite)
-        raise HTTPException(
-            status_code=403,
-            detail=f"Limite de produtos atingido para o plano {plan.upper()} ({limit})"
-        )
-
 
 # ============================================================
 # GET /product/{username}
@@ -69,23 +84,14 @@ def check_product_limit(user: BlackLinkUser, db: Session):
 # ============================================================
 @router.get("/{username}", response_model=List[ProductOut])
 def list_products_for_user(
-    username: str,
+    user: BlackLinkUser = Depends(get_user_by_username),
     db: Session = Depends(get_db)
 ):
-    user = (
-        db.query(BlackLinkUser)
-        .filter(BlackLinkUser.username == username)
-        .first()
-    )
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    products = (
-        db.query(BlackLinkProduct)
-        .filter(BlackLinkProduct.owner_id == user.id)
+    products = db.scalars(
+        select(BlackLinkProduct)
+        .where(BlackLinkProduct.owner_id == user.id)
         .order_by(BlackLinkProduct.id.desc())
-        .all()
-    )
+    ).all()
 
     return products
 
@@ -96,31 +102,49 @@ def list_products_for_user(
 # ============================================================
 @router.post("/{username}", response_model=ProductOut, status_code=201)
 def create_product_for_user(
-    username: str,
     payload: ProductCreate,
+    username: str = Depends(norm_username),
     db: Session = Depends(get_db),
 ):
-    user = (
-        db.query(BlackLinkUser)
-        .filter(BlackLinkUser.username == username)
-        .first()
-    )
-    if not user:
+    # id + plano + contagem de produtos num único SELECT
+    # (só as colunas usadas, sem hidratar o usuário inteiro)
+    row = db.execute(
+        select(
+            BlackLinkUser.id,
+            BlackLinkUser.plan,
+            BlackLinkUser.plan_expires_at,
+            _PRODUCT_COUNT,
+        )
+        .where(BlackLinkUser.username == username)
+    ).first()
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
 
+    user_id, plan, plan_expires_at, total_products = row
+
+    # plano pago vencido vale FREE aqui mesmo que o downgrade ainda não
+    # tenha sido gravado (GETs só sincronizam em memória)
+    if is_expired(plan_expires_at):
+        plan = "free"
+
     # 🔒 BLOQUEIO POR PLANO (com mensagem de upgrade)
-    check_product_limit(user, db)
+    check_product_limit(plan, total_products)
 
     product = BlackLinkProduct(
-        owner_id=user.id,
+        owner_id=user_id,
         **payload.model_dump()
     )
 
+    # flush = INSERT ... RETURNING id; a resposta sai do objeto em memória
+    # antes do commit (sem refresh = sem SELECT de recarga)
     db.add(product)
+    db.flush()
+    out = ProductOut.model_validate(product)
     db.commit()
-    db.refresh(product)
+    invalidate_products(out.owner_id)
+    set_product_url(out.id, out.url)
 
-    return product
+    return out
 
 
 # ============================================================
@@ -133,11 +157,7 @@ def update_product(
     payload: ProductUpdate,
     db: Session = Depends(get_db),
 ):
-    product = (
-        db.query(BlackLinkProduct)
-        .filter(BlackLinkProduct.id == product_id)
-        .first()
-    )
+    product = db.get(BlackLinkProduct, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
@@ -146,10 +166,13 @@ def update_product(
     for field, value in data.items():
         setattr(product, field, value)
 
+    # colunas já estão em memória: serializa antes do commit, sem refresh
+    out = ProductOut.model_validate(product)
     db.commit()
-    db.refresh(product)
+    invalidate_products(out.owner_id)
+    set_product_url(out.id, out.url)
 
-    return product
+    return out
 
 
 # ============================================================
@@ -161,15 +184,14 @@ def delete_product(
     product_id: int,
     db: Session = Depends(get_db),
 ):
-    product = (
-        db.query(BlackLinkProduct)
-        .filter(BlackLinkProduct.id == product_id)
-        .first()
-    )
+    product = db.get(BlackLinkProduct, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
+    owner_id = product.owner_id
     db.delete(product)
     db.commit()
+    invalidate_products(owner_id)
+    invalidate_product_url(product_id)
 
     return None
@@ -1,34 +1,102 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import hmac
+import time
+from functools import lru_cache
 from typing import Dict, Any, Optional, Tuple
 from datetime import datetime, timezone
 
+import orjson
 from fastapi import APIRouter, Depends, HTTPException, Request, Header
-from sqlalchemy.orm import Session
-
-import mercadopago
+from sqlalchemy import literal, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, load_only
 
 from app.database import get_db
 from app import models
 from app.config import settings
+from app.services.mp_client import get_mp_sdk
 from app.services.plan_catalog import (
     normalize_plan,
     get_plan,
     calc_plan_expiry,
     PLAN_FREE,
 )
+from app.services.plan_manager import is_expired
 
 router = APIRouter(prefix="/webhook", tags=["Webhook"])
 
 
 # ============================================================
-# 🔐 Segurança opcional (Header Secret)
+# 🔐 Segurança opcional
+# Com MP_WEBHOOK_SECRET definido, aceita:
+# - header X-Webhook-Secret igual ao segredo (chamadas próprias/testes)
+# - header x-signature do Mercado Pago (HMAC-SHA256 do manifest)
 # ============================================================
-def _verify_webhook_secret(x_webhook_secret: Optional[str]) -> None:
+def _valid_mp_signature(
+    secret: str,
+    x_signature: Optional[str],
+    x_request_id: Optional[str],
+    data_id: Optional[str],
+    now: Optional[float] = None,
+) -> bool:
+    """
+    x-signature: "ts=<epoch>,v1=<hex>"
+    manifest:    "id:<data.id>;request-id:<x-request-id>;ts:<ts>;"
+    (partes ausentes ficam fora do manifest, como na doc do MP)
+    ts fora de MP_SIGNATURE_TOLERANCE_SECONDS é recusado: uma requisição
+    assinada capturada não pode ser reenviada depois.
+    """
+    if not x_signature:
+        return False
+
+    parts = {}
+    for item in x_signature.split(","):
+        key, sep, value = item.partition("=")
+        if sep:
+            parts[key.strip()] = value.strip()
+
+    ts, v1 = parts.get("ts"), parts.get("v1")
+    if not ts or not v1:
+        return False
+
+    try:
+        ts_seconds = int(ts)
+    except ValueError:
+        return False
+    if ts_seconds > 10**11:  # epoch em milissegundos
+        ts_seconds //= 1000
+    now = time.time() if now is None else now
+    if abs(now - ts_seconds) > settings.MP_SIGNATURE_TOLERANCE_SECONDS:
+        return False
+
+    manifest = ""
+    if data_id:
+        manifest += f"id:{data_id.lower()};"
+    if x_request_id:
+        manifest += f"request-id:{x_request_id};"
+    manifest += f"ts:{ts};"
+
+    expected = hmac.new(secret.encode(), manifest.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, v1)
+
+
+def _verify_webhook_secret(
+    x_webhook_secret: Optional[str],
+    x_signature: Optional[str] = None,
+    x_request_id: Optional[str] = None,
+    data_id: Optional[str] = None,
+) -> None:
     secret = getattr(settings, "MP_WEBHOOK_SECRET", None)
     if secret:
-        if not x_webhook_secret or x_webhook_secret != secret:
-            raise HTTPException(status_code=403, detail="Webhook não autorizado")
+        # comparação em tempo constante (não vaza prefixo/tamanho por timing)
+        if x_webhook_secret and hmac.compare_digest(x_webhook_secret.encode(), secret.encode()):
+            return
+        if _valid_mp_signature(secret, x_signature, x_request_id, data_id):
+            return
+        raise HTTPException(status_code=403, detail="Webhook não autorizado")
 
 
 # ============================================================
@@ -46,18 +114,26 @@ def _is_test_mode() -> bool:
 # ============================================================
 # 🔧 Aplicar plano pago
 # ============================================================
-def apply_paid_plan(*, user: models.BlackLinkUser, plan_id: str, months: int) -> None:
+def apply_paid_plan(
+    *,
+    user: models.BlackLinkUser,
+    plan_id: str,
+    months: int,
+    now: Optional[datetime] = None,
+) -> None:
     plan = get_plan(plan_id)
     if not plan.is_sellable:
         raise HTTPException(status_code=400, detail="Plano não vendável")
 
-    now = datetime.now(timezone.utc)
+    now = now or datetime.now(timezone.utc)
 
+    # plan_expires_at volta do banco sem tz (coluna DateTime naive, em UTC):
+    # is_expired normaliza antes de comparar com o `now` aware
     if (
         user.plan in ("pro", "don")
         and user.plan_status == "active"
         and user.plan_expires_at
-        and user.plan_expires_at > now
+        and not is_expired(user.plan_expires_at, now=now)
     ):
         start_at = user.plan_expires_at
     else:
@@ -75,11 +151,41 @@ def apply_paid_plan(*, user: models.BlackLinkUser, plan_id: str, months: int) ->
     user.plan_expires_at = expires_at
 
 
+# só as colunas que apply_paid_plan/e-mail leem e gravam
+_USER_FOR_PLAN = select(models.BlackLinkUser).options(
+    load_only(
+        models.BlackLinkUser.username,
+        models.BlackLinkUser.email,
+        models.BlackLinkUser.plan,
+        models.BlackLinkUser.plan_status,
+        models.BlackLinkUser.plan_started_at,
+        models.BlackLinkUser.plan_expires_at,
+        models.BlackLinkUser.last_paid_plan,
+        models.BlackLinkUser.last_paid_expires_at,
+    )
+)
+
+
 # ============================================================
 # 🧩 Helpers
 # ============================================================
+def _event_topic(payload: Dict[str, Any], query: Any) -> Optional[str]:
+    """
+    Webhooks mandam "type" (ou "action": "payment.updated") no corpo;
+    IPN manda ?topic=...&id=... na query.
+    """
+    topic = payload.get("type") or payload.get("topic") or query.get("type") or query.get("topic")
+    if not topic:
+        action = payload.get("action")
+        if isinstance(action, str) and "." in action:
+            topic = action.split(".", 1)[0]
+    return str(topic).lower() if topic else None
+
+
 def _extract_payment_id(payload: Dict[str, Any]) -> Optional[str]:
-    data = payload.get("data") or {}
+    data = payload.get("data")
+    if not isinstance(data, dict):
+        data = {}
     pid = data.get("id") or payload.get("id") or payload.get("data_id")
     if pid:
         return str(pid)
@@ -91,7 +197,17 @@ def _extract_payment_id(payload: Dict[str, Any]) -> Optional[str]:
     return None
 
 
-def _parse_external_reference(external_reference: str) -> Tuple[str, str, int]:
+def _parse_external_reference(external_reference: Any) -> Tuple[str, str, int]:
+    # payload é JSON livre: só str é hasheável/parseável
+    if not isinstance(external_reference, str):
+        raise HTTPException(status_code=400, detail="external_reference inválido")
+    return _parse_external_reference_str(external_reference)
+
+
+# o MP reentrega a mesma notificação várias vezes: o parse fica em cache
+# (referência inválida levanta HTTPException e não entra no cache)
+@lru_cache(maxsize=4096)
+def _parse_external_reference_str(external_reference: str) -> Tuple[str, str, int]:
     if not external_reference or ":" not in external_reference:
         raise HTTPException(status_code=400, detail="external_reference inválido")
 
@@ -114,33 +230,120 @@ def _parse_external_reference(external_reference: str) -> Tuple[str, str, int]:
 
 
 # ============================================================
-# 🧠 Idempotência (best-effort)
+# 🧠 Idempotência — tabela processed_payments (UNIQUE mp_payment_id)
 # ============================================================
 def _already_processed(db: Session, payment_id: str) -> bool:
-    for model_name in ("ProcessedPayment", "Payment", "PaymentEvent", "MercadoPagoPayment"):
-        model_cls = getattr(models, model_name, None)
-        if not model_cls:
-            continue
-        for field in ("mp_payment_id", "payment_id", "external_id"):
-            if hasattr(model_cls, field):
-                if db.query(model_cls).filter(getattr(model_cls, field) == payment_id).first():
-                    return True
-    return False
-
-
-def _mark_processed(db: Session, payment_id: str) -> None:
-    for model_name in ("ProcessedPayment", "Payment", "PaymentEvent", "MercadoPagoPayment"):
-        model_cls = getattr(models, model_name, None)
-        if not model_cls:
-            continue
-        for field in ("mp_payment_id", "payment_id", "external_id"):
-            if hasattr(model_cls, field):
-                obj = model_cls()
-                setattr(obj, field, payment_id)
-                if hasattr(obj, "created_at"):
-                    obj.created_at = datetime.now(timezone.utc)
-                db.add(obj)
-                return
+    # atalho só-leitura: retries de pagamento já aplicado nem chamam o MP
+    return db.execute(
+        select(literal(1))
+        .where(models.ProcessedPayment.mp_payment_id == payment_id)
+        .limit(1)
+    ).scalar() is not None
+
+
+def _claim_payment(db: Session, payment_id: str, now: datetime) -> bool:
+    """
+    Reserva o pagamento ANTES de aplicar o plano, na mesma transação.
+    False = outra entrega já reservou (UNIQUE); a transação é desfeita.
+    """
+    db.add(models.ProcessedPayment(mp_payment_id=payment_id, created_at=now))
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        return False
+    return True
+
+
+# ============================================================
+# 🧾 Processamento (síncrono — chamado via asyncio.to_thread)
+# ============================================================
+def _lock_for_write(db: Session) -> None:
+    """
+    SQLite ignora FOR UPDATE e o driver só abre a transação no primeiro
+    INSERT/UPDATE — depois do SELECT. BEGIN IMMEDIATE pega o lock de
+    escrita ANTES da leitura (quem chegar depois espera o busy timeout).
+    """
+    conn = db.connection()
+    if conn.dialect.name != "sqlite":
+        return
+    if not conn.connection.driver_connection.in_transaction:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def _get_user_for_plan(db: Session, username: str) -> models.BlackLinkUser:
+    # dois pagamentos aprovados do mesmo usuário em paralelo não podem
+    # calcular a renovação sobre o mesmo plan_expires_at:
+    # FOR UPDATE no Postgres, BEGIN IMMEDIATE no SQLite
+    _lock_for_write(db)
+    user = db.execute(
+        _USER_FOR_PLAN
+        .where(models.BlackLinkUser.username == username)
+        .with_for_update()
+    ).scalar_one_or_none()
+    if not user:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
+    return user
+
+
+def _process_test_payload(db: Session, payload: Dict[str, Any]) -> Dict[str, Any]:
+    status = (payload.get("status") or "").lower()
+    if status != "approved":
+        return {"status": "ignored", "mode": "test"}
+
+    external_reference = payload.get("external_reference", "")
+    username, plan_id, months = _parse_external_reference(external_reference)
+
+    user = _get_user_for_plan(db, username)
+
+    apply_paid_plan(user=user, plan_id=plan_id, months=months)
+
+    # resposta montada antes do commit (que expiraria o usuário)
+    result = {
+        "status": "processed",
+        "mode": "test",
+        "username": user.username,
+        "plan": user.plan,
+    }
+    db.commit()
+
+    return result
+
+
+def _process_approved_payment(db: Session, payment_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    username, plan_id, months = _parse_external_reference(
+        data.get("external_reference", "")
+    )
+
+    user = _get_user_for_plan(db, username)
+
+    # outra entrega do mesmo pagamento chegou primeiro: o plano é dela
+    # um único `now`: processed_payments.created_at == plan_started_at
+    # (em plano novo), auditoria bate exatamente
+    now = datetime.now(timezone.utc)
+    if not _claim_payment(db, payment_id, now):
+        return {"status": "ignored", "reason": "Pagamento já processado"}
+
+    apply_paid_plan(user=user, plan_id=plan_id, months=months, now=now)
+
+    payer_email = (data.get("payer") or {}).get("email")
+    if payer_email and not user.email:
+        user.email = payer_email
+
+    # resposta montada antes do commit (que expiraria o usuário):
+    # sem SELECT de recarga depois do UPDATE
+    result = {
+        "status": "processed",
+        "mode": "production",
+        "username": user.username,
+        "plan": user.plan,
+        "expires_at": user.plan_expires_at,
+    }
+
+    # reserva + plano no mesmo commit: ou os dois, ou nenhum
+    db.commit()
+
+    return result
 
 
 # ============================================================
@@ -151,55 +354,52 @@ async def mercadopago_webhook(
     request: Request,
     db: Session = Depends(get_db),
     x_webhook_secret: str | None = Header(default=None),
+    x_signature: str | None = Header(default=None),
+    x_request_id: str | None = Header(default=None),
 ):
-    _verify_webhook_secret(x_webhook_secret)
+    # o MP manda o id do recurso na query (?data.id=...) e assina com ele
+    _verify_webhook_secret(
+        x_webhook_secret,
+        x_signature,
+        x_request_id,
+        request.query_params.get("data.id"),
+    )
 
     try:
-        payload = await request.json()
-    except Exception:
+        payload = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="JSON inválido")
+
+    if not isinstance(payload, dict):
         raise HTTPException(status_code=400, detail="JSON inválido")
 
     # ========================================================
     # 🧪 TEST MODE — NÃO EXIGE payment_id
     # ========================================================
+    # Session é síncrona: todo acesso ao banco vai para thread
+    # (asyncio.to_thread), o event loop nunca espera SELECT/commit
     if _is_test_mode():
-        status = (payload.get("status") or "").lower()
-        if status != "approved":
-            return {"status": "ignored", "mode": "test"}
-
-        external_reference = payload.get("external_reference", "")
-        username, plan_id, months = _parse_external_reference(external_reference)
-
-        user = db.query(models.BlackLinkUser).filter_by(username=username).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuário não encontrado")
-
-        apply_paid_plan(user=user, plan_id=plan_id, months=months)
-        db.commit()
-
-        return {
-            "status": "processed",
-            "mode": "test",
-            "username": user.username,
-            "plan": user.plan,
-        }
+        return await asyncio.to_thread(_process_test_payload, db, payload)
 
     # ========================================================
     # 🚀 PRODUÇÃO — payment_id OBRIGATÓRIO
     # ========================================================
+    # merchant_order, plan, etc.: 200 sem tocar banco nem MP (o "id"
+    # deles não é de pagamento; um 400 só faria o MP reenviar)
+    topic = _event_topic(payload, request.query_params)
+    if topic and topic != "payment":
+        return {"status": "ignored", "reason": f"Evento {topic} não tratado"}
+
     payment_id = _extract_payment_id(payload)
     if not payment_id:
         raise HTTPException(status_code=400, detail="payment_id ausente")
 
-    if _already_processed(db, payment_id):
+    if await asyncio.to_thread(_already_processed, db, payment_id):
         return {"status": "ignored", "reason": "Pagamento já processado"}
 
-    token = (settings.MP_ACCESS_TOKEN or "").strip()
-    if not token:
-        raise HTTPException(status_code=500, detail="MP_ACCESS_TOKEN ausente")
-
-    sdk = mercadopago.SDK(token)
-    mp_payment = sdk.payment().get(payment_id)
+    # SDK compartilhado (keep-alive): sem TCP/TLS novo a cada notificação.
+    # O SDK é síncrono (requests): roda em thread para não travar o event loop
+    mp_payment = await asyncio.to_thread(get_mp_sdk().payment().get, payment_id)
 
     if mp_payment.get("status") != 200:
         raise HTTPException(status_code=400, detail="Pagamento não encontrado no MP")
@@ -208,27 +408,4 @@ async def mercadopago_webhook(
     if data.get("status") != "approved":
         return {"status": "ignored", "reason": "Pagamento não aprovado"}
 
-    username, plan_id, months = _parse_external_reference(
-        data.get("external_reference", "")
-    )
-
-    user = db.query(models.BlackLinkUser).filter_by(username=username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuário não encontrado")
-
-    apply_paid_plan(user=user, plan_id=plan_id, months=months)
-
-    payer_email = (data.get("payer") or {}).get("email")
-    if payer_email and not user.email:
-        user.email = payer_email
-
-    _mark_processed(db, payment_id)
-    db.commit()
-
-    return {
-        "status": "processed",
-        "mode": "production",
-        "username": user.username,
-        "plan": user.plan,
-        "expires_at": user.plan_expires_at,
-    }
+    return await asyncio.to_thread(_process_approved_payment, db, payment_id, data)
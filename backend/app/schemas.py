@@ -3,7 +3,7 @@ from __future__ import annotations
 from typing import Optional, List
 from datetime import datetime
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, field_validator
 
 
 # ============================================================
@@ -50,6 +50,22 @@ class ProductOut(ProductBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class ProductListItem(BaseModel):
+    """
+    Item de GET /api/blacklink/{username}/products
+    (campos = colunas selecionadas pela rota, na mesma ordem).
+    """
+    id: int
+    owner_id: int
+    title: str
+    description: Optional[str] = None
+    url: Optional[str] = None
+    tag: Optional[str] = None
+    badge: Optional[str] = None
+    cta_label: Optional[str] = None
+    model_config = ConfigDict(from_attributes=True)
+
+
 # ============================================================
 # USERS
 # ============================================================
@@ -85,7 +101,10 @@ class UserBase(BaseModel):
 
 
 class UserCreate(UserBase):
-    pass
+    @field_validator("username", mode="before")
+    @classmethod
+    def _norm_username(cls, v):
+        return v.strip().lower() if isinstance(v, str) else v
 
 
 class UserUpdate(BaseModel):
@@ -130,6 +149,19 @@ class AdminCreateUser(BaseModel):
     email: str
     plan: Optional[str] = "free"
 
+    @field_validator("username", "email", mode="before")
+    @classmethod
+    def _norm_username(cls, v):
+        return v.strip().lower() if isinstance(v, str) else v
+
+
+class AdminCreateUserOut(BaseModel):
+    id: int
+    username: str
+    email: Optional[str] = None
+    plan: str
+    status: str
+
 
 class AdminIngestRequest(BaseModel):
     username: str
@@ -155,8 +187,3 @@ class PaymentProcessResponse(BaseModel):
     plan: str
     plan_status: str
     plan_expires_at: Optional[datetime] = None
-
-class AdminCreateUser(BaseModel):
-    username: str
-    email: str
-    plan: Optional[str] = "free"
@@ -1,94 +1,323 @@
-import httpx
+import asyncio
+import random
 import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+import httpx
+from sqlalchemy import case, func, or_, select, update
 from sqlalchemy.orm import Session
-from typing import List
 
 from app.database import SessionLocal
 from app import models
 from app.config import PLAN_LIMITS
+from app.services.plan_manager import sync_user_plans
 
 
 # ============================================================
 # 🔁 LINK GUARDIAN
 # Serviço autônomo de validação de links afiliados
 # Enforce PASSO 2: somente PRO/DON
+#
+# Roda como task asyncio no event loop do FastAPI (ver lifespan em
+# main.py): os HEADs são I/O puro e o acesso ao banco vai para
+# asyncio.to_thread, então o guardian não disputa o GIL com os handlers.
 # ============================================================
 
 CHECK_INTERVAL_SECONDS = 60 * 30  # 30 minutos
 
+# verificadores (HEADs simultâneos) por varredura (= conexões no pool do client)
+MAX_CONCURRENT_CHECKS = 20
+
+# produtos carregados do banco por vez durante a varredura
+SWEEP_BATCH = 500
+
+# ids por UPDATE ... WHERE id IN (...) ao gravar o resultado
+DEACTIVATE_CHUNK = 1000
+
+# varreduras seguidas com link morto antes de desativar (um 404 isolado não derruba)
+DEAD_STRIKES_TO_DEACTIVATE = 2
+
+# cada worker do uvicorn roda o seu guardian: um strike só conta se o último
+# foi há pelo menos meio intervalo (a mesma varredura em N workers = 1 strike)
+STRIKE_MIN_GAP_SECONDS = CHECK_INTERVAL_SECONDS // 2
+
+# backoff em falhas consecutivas da varredura: 30s, 60s, 120s ... até o intervalo normal
+RETRY_BASE_SECONDS = 30
 
-def _is_link_alive(url: str) -> bool:
+
+# fallback quando o servidor recusa HEAD (405); 200 ou 206 = vivo
+_PROBE_HEADERS = {"User-Agent": "Mozilla/5.0", "Range": "bytes=0-0"}
+
+# url -> (expira_em, vivo), em ordem de uso (LRU)
+# sem lock: só é acessado do event loop
+_ALIVE_CACHE: "OrderedDict[str, Tuple[float, bool]]" = OrderedDict()
+_ALIVE_TTL_SECONDS = 60 * 60 * 6  # link vivo: pula o HEAD nas próximas ~12 varreduras
+_DEAD_TTL_SECONDS = 600  # link morto: curto, para reconfirmar antes de confiar
+_ALIVE_CACHE_MAX = 50_000
+
+
+async def _is_link_alive(client: httpx.AsyncClient, url: str, fresh: bool = False) -> bool:
+    """
+    fresh=True ignora o cache (confirmação de um link que já falhou).
+    """
     if not url:
         return False
 
     if "mercadolivre.com" not in url:
         return True
 
-    try:
-        with httpx.Client(follow_redirects=True, timeout=5.0) as client:
-            resp = client.head(url)
-            if resp.status_code == 405:
-                resp = client.get(url, headers={"User-Agent": "Mozilla/5.0"})
+    now = time.monotonic()
+    hit = None if fresh else _ALIVE_CACHE.get(url)
+    if hit and hit[0] > now:
+        _ALIVE_CACHE.move_to_end(url)
+        return hit[1]
 
-        if resp.status_code in (404, 410):
-            return False
+    try:
+        resp = await client.head(url)
+        if resp.status_code == 405:
+            # GET de 1 byte em stream: só o status interessa, não o HTML
+            async with client.stream("GET", url, headers=_PROBE_HEADERS) as resp:
+                pass
 
-        return True
+        alive = resp.status_code not in (404, 410)
 
     except httpx.RequestError:
-        return True
+        return True  # falha de rede não derruba o produto (nem vai pro cache)
+
+    _ALIVE_CACHE[url] = (now + (_ALIVE_TTL_SECONDS if alive else _DEAD_TTL_SECONDS), alive)
+    _ALIVE_CACHE.move_to_end(url)
+    if len(_ALIVE_CACHE) > _ALIVE_CACHE_MAX:
+        _ALIVE_CACHE.popitem(last=False)  # descarta o menos usado
 
+    return alive
 
-def _guardian_enabled_for_plan(plan: str | None) -> bool:
-    p = (plan or "free").lower().strip()
-    return PLAN_LIMITS.get(p, PLAN_LIMITS["free"]).get("link_guardian", False)
 
+# 🔒 Enforce PASSO 2: Guardian só atua em PRO/DON (planos com link_guardian)
+_GUARDIAN_PLANS = frozenset(p for p, limits in PLAN_LIMITS.items() if limits.link_guardian)
 
-def run_link_guardian():
+
+def _load_candidates(after_id: int = 0, limit: int = SWEEP_BATCH) -> List[Tuple[int, str, int]]:
     """
-    Loop infinito de verificação automática.
-    Roda enquanto o backend estiver ligado.
+    Próximo lote de produtos ativos de donos PRO/DON,
+    como (id, url, dead_strike_count).
+    Um único SELECT com JOIN (sem 1 SELECT de usuário por produto),
+    paginado por id (keyset): a memória fica O(lote), não O(catálogo).
     """
+    # plano pago vencido (downgrade ainda não gravado) não tem guardian;
+    # DateTime guarda UTC sem fuso
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
 
-    print("🛡️ Link Guardian iniciado.")
-
-    while True:
-        db: Session = SessionLocal()
-        try:
-            products: List[models.BlackLinkProduct] = (
-                db.query(models.BlackLinkProduct)
-                .filter(models.BlackLinkProduct.is_active == 1)
-                .all()
+    db: Session = SessionLocal()
+    try:
+        rows = db.execute(
+            select(
+                models.BlackLinkProduct.id,
+                models.BlackLinkProduct.url,
+                func.coalesce(models.BlackLinkProduct.dead_strike_count, 0),
+            )
+            .join(models.BlackLinkUser, models.BlackLinkUser.id == models.BlackLinkProduct.owner_id)
+            .where(
+                models.BlackLinkProduct.id > after_id,
+                models.BlackLinkProduct.is_active == 1,
+                func.lower(func.trim(models.BlackLinkUser.plan)).in_(_GUARDIAN_PLANS),
+                or_(
+                    models.BlackLinkUser.plan_expires_at.is_(None),
+                    models.BlackLinkUser.plan_expires_at >= now,
+                ),
             )
+            .order_by(models.BlackLinkProduct.id)
+            .limit(limit)
+        ).all()
+        return [tuple(row) for row in rows]
+
+    finally:
+        db.close()
+
+
+def _record_results(dead_ids: List[int], recovered_ids: List[int]) -> List[Tuple[str, int, int]]:
+    """
+    Grava o resultado da checagem com um UPDATE por lote (e não um por
+    produto), em fatias de DEACTIVATE_CHUNK para não estourar o limite de
+    parâmetros do banco:
+    - dead_ids: +1 strike; ao chegar em DEAD_STRIKES_TO_DEACTIVATE desativa
+      (e zera o contador, para um produto reativado pelo dono começar limpo).
+      Produto com strike há menos de STRIKE_MIN_GAP_SECONDS fica de fora:
+      outro worker já contou esta varredura.
+    - recovered_ids: link voltou antes de desativar → zera o contador
+    Devolve (title, is_active, dead_strike_count) de quem o UPDATE de fato
+    marcou — é isso que o escritor loga, e não o strike lido na varredura.
+    """
+    Product = models.BlackLinkProduct
+    strikes = func.coalesce(Product.dead_strike_count, 0) + 1
+    confirmed = strikes >= DEAD_STRIKES_TO_DEACTIVATE
 
-            for product in products:
-                # 🔒 Enforce PASSO 2: Guardian só atua em PRO/DON
-                user = (
-                    db.query(models.BlackLinkUser)
-                    .filter(models.BlackLinkUser.id == product.owner_id)
-                    .first()
+    # DateTime guarda UTC sem fuso
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    strike_due = or_(
+        Product.last_dead_check_at.is_(None),
+        Product.last_dead_check_at <= now - timedelta(seconds=STRIKE_MIN_GAP_SECONDS),
+    )
+
+    struck: List[Tuple[str, int, int]] = []
+    db: Session = SessionLocal()
+    try:
+        # SQLite >= 3.35 e Postgres têm RETURNING; senão relê pelo carimbo
+        returning = db.get_bind().dialect.update_returning
+        marked = (Product.title, Product.is_active, Product.dead_strike_count)
+
+        for i in range(0, len(dead_ids), DEACTIVATE_CHUNK):
+            chunk = dead_ids[i:i + DEACTIVATE_CHUNK]
+            stmt = (
+                update(Product)
+                .where(Product.id.in_(chunk), strike_due)
+                .values(
+                    is_active=case((confirmed, 0), else_=Product.is_active),
+                    is_featured=case((confirmed, 0), else_=Product.is_featured),
+                    dead_strike_count=case((confirmed, 0), else_=strikes),
+                    last_dead_check_at=now,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if returning:
+                struck.extend(tuple(row) for row in db.execute(stmt.returning(*marked)))
+            else:
+                db.execute(stmt)
+                struck.extend(
+                    tuple(row) for row in db.execute(
+                        select(*marked).where(Product.id.in_(chunk), Product.last_dead_check_at == now)
+                    )
                 )
 
-                if not user:
-                    continue
+        for i in range(0, len(recovered_ids), DEACTIVATE_CHUNK):
+            db.execute(
+                update(Product)
+                .where(Product.id.in_(recovered_ids[i:i + DEACTIVATE_CHUNK]))
+                .values(dead_strike_count=0)
+                .execution_options(synchronize_session=False)
+            )
+
+        db.commit()
+        return struck
+
+    finally:
+        db.close()
+
+
+async def _sweep(client: httpx.AsyncClient) -> None:
+    """
+    Pipeline: produtor (lotes do banco) -> fila -> MAX_CONCURRENT_CHECKS
+    verificadores (HEAD) -> fila -> escritor (UPDATE em lote).
+    Leitura, rede e escrita se sobrepõem; as filas limitadas seguram o
+    produtor quando os HEADs ficam para trás.
+    Erro em qualquer etapa cancela as outras (TaskGroup) e sobe para o loop.
+    """
+    q_check: "asyncio.Queue[Optional[Tuple[int, str, int]]]" = asyncio.Queue(SWEEP_BATCH * 2)
+    # (product_id, morto?) — só o que muda no banco: link morto ou que se recuperou
+    q_results: "asyncio.Queue[Optional[Tuple[int, bool]]]" = asyncio.Queue(DEACTIVATE_CHUNK)
+
+    async def produce() -> None:
+        last_id = 0
+        while True:
+            candidates = await asyncio.to_thread(_load_candidates, last_id)
+            for candidate in candidates:
+                await q_check.put(candidate)
+            if len(candidates) < SWEEP_BATCH:
+                break
+            last_id = candidates[-1][0]
+
+        for _ in range(MAX_CONCURRENT_CHECKS):
+            await q_check.put(None)
+
+    async def check() -> None:
+        while (candidate := await q_check.get()) is not None:
+            product_id, url, strikes = candidate
+            # strike pendente: reconfirma na rede, não no cache
+            if not await _is_link_alive(client, url, fresh=strikes > 0):
+                await q_results.put((product_id, True))
+            elif strikes:
+                await q_results.put((product_id, False))
 
-                if not _guardian_enabled_for_plan(user.plan):
-                    continue
+    async def write() -> None:
+        # junta o que já estiver na fila num único UPDATE
+        done = False
+        while not done:
+            dead: List[int] = []
+            recovered: List[int] = []
+            result = await q_results.get()
+            while result is not None:
+                (dead if result[1] else recovered).append(result[0])
+                if len(dead) + len(recovered) >= DEACTIVATE_CHUNK or q_results.empty():
+                    break
+                result = q_results.get_nowait()
+            done = result is None
 
-                alive = _is_link_alive(product.url)
+            if dead or recovered:
+                struck = await asyncio.to_thread(_record_results, dead, recovered)
+                # loga o que o UPDATE gravou: strike já contado por outro worker não aparece
+                for title, is_active, strikes in struck:
+                    if not is_active:
+                        print(f"❌ Produto desativado automaticamente: {title}")
+                    else:
+                        print(f"⚠️ Link fora do ar ({strikes}/{DEAD_STRIKES_TO_DEACTIVATE}): {title}")
+
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(write())
+        async with asyncio.TaskGroup() as checkers:
+            checkers.create_task(produce())
+            for _ in range(MAX_CONCURRENT_CHECKS):
+                checkers.create_task(check())
+        await q_results.put(None)  # verificadores terminaram: libera o escritor
+
+
+def _expire_plans() -> int:
+    """
+    Grava o downgrade de todos os planos pagos vencidos (um UPDATE só).
+    As rotas de leitura só rebaixam em memória: é aqui que o banco alcança.
+    """
+    db: Session = SessionLocal()
+    try:
+        return sync_user_plans(db)
+
+    finally:
+        db.close()
+
+
+async def run_link_guardian():
+    """
+    Loop infinito de verificação automática.
+    Roda enquanto o backend estiver ligado (cancelado no shutdown).
+    A cada volta também grava os planos vencidos (antes da varredura,
+    que só cobre PRO/DON em dia).
+    """
+
+    print("🛡️ Link Guardian iniciado.")
 
-                if not alive:
-                    product.is_active = 0
-                    product.is_featured = 0
-                    db.add(product)
-                    print(f"❌ Produto desativado automaticamente: {product.title}")
+    failures = 0
 
-            db.commit()
+    async with httpx.AsyncClient(
+        follow_redirects=True,
+        timeout=5.0,
+        limits=httpx.Limits(
+            max_connections=MAX_CONCURRENT_CHECKS,
+            max_keepalive_connections=MAX_CONCURRENT_CHECKS,
+        ),
+    ) as client:
+        while True:
+            try:
+                downgraded = await asyncio.to_thread(_expire_plans)
+                if downgraded:
+                    print(f"⏬ {downgraded} plano(s) vencido(s) rebaixado(s) para FREE")
 
-        except Exception as e:
-            print("⚠️ Erro no Link Guardian:", e)
+                await _sweep(client)
+                failures = 0
+                delay = CHECK_INTERVAL_SECONDS
 
-        finally:
-            db.close()
+            except Exception as e:
+                failures += 1
+                print("⚠️ Erro no Link Guardian:", e)
+                delay = min(CHECK_INTERVAL_SECONDS, RETRY_BASE_SECONDS * 2 ** (failures - 1))
+                delay *= random.uniform(0.5, 1.0)  # jitter
 
-        time.sleep(CHECK_INTERVAL_SECONDS)
+            await asyncio.sleep(delay)
@@ -1,22 +1,9 @@
 from __future__ import annotations
 
-import os
 from typing import Dict, Any
 
-import mercadopago
-
-from app.services.plan_catalog import get_plan, price_brl
-
-
-# ============================================================
-# CLIENTE MERCADO PAGO
-# ============================================================
-MP_ACCESS_TOKEN = os.getenv("MP_ACCESS_TOKEN")
-
-if not MP_ACCESS_TOKEN:
-    raise RuntimeError("MP_ACCESS_TOKEN não configurado no .env")
-
-sdk = mercadopago.SDK(MP_ACCESS_TOKEN)
+from app.services.mp_client import get_mp_sdk
+from app.services.plan_catalog import get_plan, total_price_brl
 
 
 # ============================================================
@@ -38,7 +25,7 @@ def create_payment_preference(
         raise ValueError("Plano não vendável")
 
     months = max(1, int(months))
-    unit_price = price_brl(plan) * months
+    unit_price = total_price_brl(plan, months)
 
     preference_data = {
         "items": [
@@ -48,7 +35,7 @@ def create_payment_preference(
                 "description": f"CosaNostra BlackLink — Plano {plan.name}",
                 "quantity": 1,
                 "currency_id": "BRL",
-                "unit_price": float(unit_price),
+                "unit_price": unit_price,
             }
         ],
         "payer": {
@@ -71,7 +58,8 @@ def create_payment_preference(
         "binary_mode": True,
     }
 
-    preference_response = sdk.preference().create(preference_data)
+    # SDK único do processo (keep-alive; token checado no primeiro uso)
+    preference_response = get_mp_sdk().preference().create(preference_data)
 
     if preference_response.get("status") != 201:
         raise RuntimeError("Erro ao criar preference Mercado Pago")
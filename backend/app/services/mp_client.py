@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import threading
+from typing import Dict, Optional
+
+import mercadopago
+import requests
+from fastapi import HTTPException
+from mercadopago.config.defaults import DEFAULT_RETRY_ON
+from mercadopago.errors.exceptions import MPServerError
+from mercadopago.http.http_client import HttpClient
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from app.config import settings
+
+# ============================================================
+# 🔐 BLINDAGEM — MERCADO PAGO SDK
+# Instância única (por processo) compartilhada por /payment e /webhook
+# ============================================================
+
+class _KeepAliveHttpClient(HttpClient):
+    """
+    O HttpClient padrão do SDK abre um requests.Session novo (TCP + TLS)
+    a cada chamada. Aqui uma Session por configuração de retry é
+    reaproveitada: checkout/consulta usam keep-alive com a API do MP.
+    request() espelha o HttpClient.request do SDK (o original fecha a
+    Session no fim, então não dá para delegar ao super()): por isso o
+    mercadopago fica fixado nos requirements — revisar ao atualizar.
+    """
+
+    def __init__(self) -> None:
+        self._sessions: Dict[tuple, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def _session(self, maxretries, retry_on, backoff_factor) -> requests.Session:
+        key = (maxretries, tuple(retry_on) if retry_on is not None else None, backoff_factor)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                session.mount("https://", HTTPAdapter(max_retries=Retry(
+                    total=maxretries,
+                    status_forcelist=retry_on if retry_on is not None else DEFAULT_RETRY_ON,
+                    backoff_factor=backoff_factor or 0,
+                )))
+                self._sessions[key] = session
+        return session
+
+    def request(self, method, url, maxretries=None, retry_on=None, backoff_factor=None, **kwargs):
+        api_result = self._session(maxretries, retry_on, backoff_factor).request(method, url, **kwargs)
+        response = {"status": api_result.status_code, "response": None}
+
+        if api_result.status_code != 204 and api_result.content:
+            try:
+                response["response"] = api_result.json()
+            except ValueError as exc:
+                raise MPServerError(
+                    api_result.status_code,
+                    {"message": "Invalid JSON in response body", "error": "invalid_response"},
+                ) from exc
+
+        return response
+
+
+# singleton preguiçoso: criado no primeiro uso, não no import.
+# Sem token o app sobe normalmente e só os endpoints de pagamento falham.
+_sdk: Optional[mercadopago.SDK] = None
+
+
+def get_mp_sdk() -> mercadopago.SDK:
+    global _sdk
+
+    if _sdk is None:
+        token = (settings.MP_ACCESS_TOKEN or "").strip()
+        if not token:
+            raise HTTPException(status_code=500, detail="MP_ACCESS_TOKEN não definido ou inválido")
+        _sdk = mercadopago.SDK(token, http_client=_KeepAliveHttpClient())
+
+    return _sdk
@@ -2,7 +2,9 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Optional, Any
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple, Any
 
 
 # ============================================================
@@ -124,6 +126,9 @@ _CATALOG: Dict[str, Plan] = {
 # HELPERS (API interna do catálogo)
 # ============================================================
 def normalize_plan(plan: Optional[str]) -> str:
+    # caminho comum: id canônico já normalizado (sem strip/lower)
+    if plan in ALL_PLANS:
+        return plan
     if not plan:
         return PLAN_FREE
     p = str(plan).strip().lower()
@@ -136,6 +141,16 @@ def get_plan(plan: Optional[str]) -> Plan:
 
 
 def list_plans(include_free: bool = True, sellable_only: bool = False) -> List[Plan]:
+    # lista nova a cada chamada: quem recebe pode alterar sem mexer no cache
+    return list(_sorted_plans(include_free, sellable_only))
+
+
+@lru_cache(maxsize=4)
+def _sorted_plans(include_free: bool, sellable_only: bool) -> Tuple[Plan, ...]:
+    """
+    Só existem 4 combinações de argumentos: cada uma é montada uma vez.
+    Tupla (imutável) porque o resultado é compartilhado entre chamadas.
+    """
     plans = list(_CATALOG.values())
     if not include_free:
         plans = [p for p in plans if p.id != PLAN_FREE]
@@ -144,7 +159,7 @@ def list_plans(include_free: bool = True, sellable_only: bool = False) -> List[P
     # ordem fixa para UI
     order = {PLAN_FREE: 0, PLAN_PRO: 1, PLAN_DON: 2}
     plans.sort(key=lambda x: order.get(x.id, 99))
-    return plans
+    return tuple(plans)
 
 
 def price_brl(plan: Plan) -> float:
@@ -152,15 +167,29 @@ def price_brl(plan: Plan) -> float:
     return plan.price_brl_cents / 100.0
 
 
+def total_price_brl(plan: Plan, months: int) -> float:
+    """
+    Total em reais para `months` meses (unit_price do Mercado Pago).
+    Multiplica em centavos (inteiro) e divide uma vez só:
+    1990 * 3 / 100 = 59.7, enquanto 19.9 * 3 = 59.699999999999996.
+    """
+    return plan.price_brl_cents * months / 100
+
+
+# duração de 1 "mês" de cada plano pago (FREE não expira: fica fora)
+_PERIOD_DELTA: Dict[str, timedelta] = {
+    pid: timedelta(days=p.duration_days) for pid, p in _CATALOG.items() if pid != PLAN_FREE
+}
+
+
 def calc_plan_expiry(start_at: datetime, months: int, plan_id: str) -> Optional[datetime]:
     """
     Regras:
     - FREE não tem expiração por pagamento → None
     - PRO/DON: expira start + (duration_days * months)
     """
-    plan = get_plan(plan_id)
-
-    if plan.id == PLAN_FREE:
+    delta = _PERIOD_DELTA.get(normalize_plan(plan_id))
+    if delta is None:
         return None
 
     m = int(months) if months is not None else 1
@@ -171,26 +200,41 @@ def calc_plan_expiry(start_at: datetime, months: int, plan_id: str) -> Optional[
     if start_at.tzinfo is None:
         start_at = start_at.replace(tzinfo=timezone.utc)
 
-    total_days = plan.duration_days * m
-    return start_at + timedelta(days=total_days)
+    return start_at + delta * m
+
+
+# ============================================================
+# DERIVADOS DO CATÁLOGO (calculados uma vez no import)
+# o catálogo é imutável em runtime: nada disso muda por request
+# ============================================================
+_LIMITS: Dict[str, Mapping[str, Any]] = {
+    pid: MappingProxyType(dict(p.limits)) for pid, p in _CATALOG.items()
+}
+_MAX_PRODUCTS: Dict[str, int] = {
+    pid: int(p.limits.get("max_products", 0)) for pid, p in _CATALOG.items()
+}
+_ML_INGEST: Dict[str, bool] = {
+    pid: bool(p.limits.get("ml_ingest_enabled", False)) for pid, p in _CATALOG.items()
+}
 
 
-def limits_for(plan_id: Optional[str]) -> Dict[str, Any]:
-    return dict(get_plan(plan_id).limits)
+def limits_for(plan_id: Optional[str]) -> Mapping[str, Any]:
+    """
+    Mapping somente leitura (MappingProxyType), o mesmo objeto em toda
+    chamada — antes era um dict novo. Quem precisar alterar faz dict(...).
+    """
+    return _LIMITS[normalize_plan(plan_id)]
 
 
 def is_ml_ingest_enabled(plan_id: Optional[str]) -> bool:
-    return bool(get_plan(plan_id).limits.get("ml_ingest_enabled", False))
+    return _ML_INGEST[normalize_plan(plan_id)]
 
 
 def max_products(plan_id: Optional[str]) -> int:
-    return int(get_plan(plan_id).limits.get("max_products", 0))
+    return _MAX_PRODUCTS[normalize_plan(plan_id)]
 
 
-def as_public_dict(plan: Plan) -> Dict[str, Any]:
-    """
-    Para UI/checkout: sem expor coisas internas desnecessárias.
-    """
+def _build_public_dict(plan: Plan) -> Dict[str, Any]:
     return {
         "id": plan.id,
         "name": plan.name,
@@ -203,3 +247,18 @@ def as_public_dict(plan: Plan) -> Dict[str, Any]:
         "limits": dict(plan.limits),
         "features": list(plan.features),
     }
+
+
+_PUBLIC: Dict[str, Dict[str, Any]] = {
+    pid: _build_public_dict(p) for pid, p in _CATALOG.items()
+}
+
+
+def as_public_dict(plan: Plan) -> Dict[str, Any]:
+    """
+    Para UI/checkout: sem expor coisas internas desnecessárias.
+    Planos do catálogo devolvem o dict pré-montado (compartilhado: não mutar).
+    """
+    if _CATALOG.get(plan.id) is plan:
+        return _PUBLIC[plan.id]
+    return _build_public_dict(plan)
@@ -2,8 +2,9 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Iterable, Optional
 
+from sqlalchemy import case, func, update
 from sqlalchemy.orm import Session
 
 from app import models
@@ -28,6 +29,9 @@ def utcnow() -> datetime:
 
 
 def normalize_plan(plan: Optional[str]) -> str:
+    # caminho comum: id canônico já normalizado (sem strip/lower)
+    if plan in PLAN_POLICIES:
+        return plan
     p = (plan or "free").strip().lower()
     return p if p in PLAN_POLICIES else "free"
 
@@ -49,11 +53,20 @@ def is_expired(plan_expires_at: Optional[datetime], now: Optional[datetime] = No
     return _as_utc(plan_expires_at) < _as_utc(now)
 
 
-def sync_user_plan(db: Session, user: models.BlackLinkUser, now: Optional[datetime] = None) -> models.BlackLinkUser:
+def sync_user_plan(
+    db: Session,
+    user: models.BlackLinkUser,
+    now: Optional[datetime] = None,
+    persist: bool = True,
+) -> models.BlackLinkUser:
     """
     PASSO 3:
     - Se pro/don expirou: downgrade para FREE automaticamente
     - plan_status vira "expired"
+
+    persist=False (rotas de leitura): aplica o downgrade só no objeto em
+    memória, sem UPDATE/commit — a resposta já sai com o plano certo e a
+    escrita fica para a próxima rota que altera o usuário.
     """
     now = now or utcnow()
     current_plan = normalize_plan(user.plan)
@@ -68,9 +81,8 @@ def sync_user_plan(db: Session, user: models.BlackLinkUser, now: Optional[dateti
         user.plan_started_at = None
         user.plan_expires_at = None
 
-        db.add(user)
-        db.commit()
-        db.refresh(user)
+        if persist:
+            db.commit()
         return user
 
     # se não expirou, normaliza status
@@ -80,12 +92,53 @@ def sync_user_plan(db: Session, user: models.BlackLinkUser, now: Optional[dateti
         user.plan = "free"
         user.plan_status = user.plan_status or "active"
 
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    # nada mudou: sem commit (o commit expiraria o usuário e o que veio
+    # junto por eager load, ex.: selectinload(products))
+    if persist and db.is_modified(user):
+        db.commit()
     return user
 
 
+def sync_user_plans(
+    db: Session,
+    user_ids: Optional[Iterable[int]] = None,
+    now: Optional[datetime] = None,
+) -> int:
+    """
+    Versão em lote do downgrade de sync_user_plan (ex.: job varrendo todos
+    os usuários): um único UPDATE + commit em vez de um commit por usuário.
+    user_ids=None = todos. Devolve quantos usuários foram rebaixados.
+    """
+    # as colunas DateTime guardam UTC sem fuso
+    now_utc = _as_utc(now or utcnow()).replace(tzinfo=None)
+    User = models.BlackLinkUser
+
+    # normalize_plan em SQL: plano desconhecido/vazio vira "free"
+    raw_plan = func.lower(func.trim(User.plan))
+    current_plan = case((raw_plan.in_(list(PLAN_POLICIES)), raw_plan), else_="free")
+
+    stmt = (
+        update(User)
+        .where(User.plan_expires_at.is_not(None), User.plan_expires_at < now_utc)
+        .values(
+            # guarda histórico (mesma regra de sync_user_plan)
+            last_paid_plan=func.coalesce(func.nullif(User.last_paid_plan, ""), current_plan),
+            last_paid_expires_at=func.coalesce(User.last_paid_expires_at, User.plan_expires_at),
+            plan="free",
+            plan_status="expired",
+            plan_started_at=None,
+            plan_expires_at=None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if user_ids is not None:
+        stmt = stmt.where(User.id.in_(list(user_ids)))
+
+    downgraded = db.execute(stmt).rowcount
+    db.commit()
+    return downgraded
+
+
 def apply_paid_plan(db: Session, user: models.BlackLinkUser, plan: str, months: int = 1, now: Optional[datetime] = None) -> models.BlackLinkUser:
     """
     Base vendável: aplica pro/don com expiração.
@@ -106,7 +159,7 @@ def apply_paid_plan(db: Session, user: models.BlackLinkUser, plan: str, months:
     user.last_paid_plan = plan
     user.last_paid_expires_at = expires
 
-    db.add(user)
+    # user já vem da Session do chamador (add é no-op) e nenhuma coluna tem
+    # default do banco: sem refresh, o que for lido depois recarrega sob demanda
     db.commit()
-    db.refresh(user)
     return user
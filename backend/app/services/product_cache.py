@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import time
+from typing import Dict, Optional, Tuple
+
+
+# ============================================================
+# CACHE DA API DE PRODUTOS (em memória, por processo)
+# owner_id -> (expira_em, corpo JSON já serializado)
+#
+# Invalidado pelo router /product em create/update/delete.
+# Com vários workers cada um tem o seu cache: outro worker pode
+# servir a lista antiga por até TTL_SECONDS.
+# ============================================================
+
+TTL_SECONDS = 60
+MAX_ENTRIES = 5_000
+
+_CACHE: Dict[int, Tuple[float, bytes]] = {}
+
+
+def get_products_json(owner_id: int) -> Optional[bytes]:
+    hit = _CACHE.get(owner_id)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+
+def set_products_json(owner_id: int, body: bytes) -> None:
+    if len(_CACHE) >= MAX_ENTRIES:
+        _CACHE.clear()
+    _CACHE[owner_id] = (time.monotonic() + TTL_SECONDS, body)
+
+
+def invalidate_products(owner_id: int) -> None:
+    _CACHE.pop(owner_id, None)
+
+
+# ============================================================
+# CACHE DO REDIRECT DE AFILIADO (/blacklink/out/{id})
+# product_id -> (expira_em, url)
+#
+# Aquecido pelo router /product em create/update (e no primeiro
+# clique, em caso de miss); removido em delete.
+# A invalidação também é por processo: com vários workers, uma URL
+# editada/apagada pode redirecionar em outro worker por até
+# URL_TTL_SECONDS — por isso o mesmo TTL curto da lista.
+# ============================================================
+
+URL_TTL_SECONDS = TTL_SECONDS
+URL_MAX_ENTRIES = 50_000
+
+_URLS: Dict[int, Tuple[float, str]] = {}
+
+
+def get_product_url(product_id: int) -> Optional[str]:
+    hit = _URLS.get(product_id)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+
+def set_product_url(product_id: int, url: Optional[str]) -> None:
+    if not url:
+        _URLS.pop(product_id, None)
+        return
+    if len(_URLS) >= URL_MAX_ENTRIES:
+        _URLS.clear()
+    _URLS[product_id] = (time.monotonic() + URL_TTL_SECONDS, url)
+
+
+def invalidate_product_url(product_id: int) -> None:
+    _URLS.pop(product_id, None)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import HTMLResponse
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache, Template, TemplateError
+
+from app.config import TEMPLATES_DIR, get_settings
+
+logger = logging.getLogger("blacklink")
+
+# ==================================================
+# JINJA2 — instância única compartilhada pelos routers
+# ==================================================
+templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
+
+# bytecode compilado em disco (diretório temp por usuário do SO):
+# reinícios do container pulam tokenize/parse/codegen dos templates
+templates.env.bytecode_cache = FileSystemBytecodeCache()
+
+# fora de dev os templates só mudam com deploy: não checa mtime a cada load
+templates.env.auto_reload = get_settings().ENV == "dev"
+
+
+def get_template(name: str) -> Template:
+    """
+    O Environment já guarda os templates compilados (cache interno do Jinja):
+    com auto_reload desligado um hit não checa mtime; em dev, edições são
+    recarregadas.
+    """
+    return templates.get_template(name)
+
+
+def warm_templates() -> int:
+    """
+    Compila todos os .html de TEMPLATES_DIR (chamado no startup), para o
+    primeiro request de cada worker não pagar parse/compilação.
+    Template com erro é só logado — o request que o usar devolve o erro.
+    """
+    warmed = 0
+    for path in sorted(TEMPLATES_DIR.rglob("*.html")):
+        name = path.relative_to(TEMPLATES_DIR).as_posix()
+        try:
+            get_template(name)
+            warmed += 1
+        except TemplateError as e:
+            logger.warning(f"⚠️ Template {name} não compilou: {e}")
+    return warmed
+
+
+def render(
+    name: str,
+    context: Dict[str, Any],
+    headers: Optional[Dict[str, str]] = None,
+) -> HTMLResponse:
+    """
+    Equivalente a templates.TemplateResponse(name, context).
+    `context` deve trazer "request" (usado por url_for nos templates).
+    """
+    return HTMLResponse(get_template(name).render(context), headers=headers)
+
+
+# ==================================================
+# CACHE HTTP — páginas públicas (ETag + 304)
+# ==================================================
+PUBLIC_CACHE_CONTROL = "public, max-age=60, stale-while-revalidate=300"
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    ETag forte a partir dos dados que alimentam a página (não do HTML),
+    incluindo o resultado das checagens de link: um 304 economiza o render.
+    """
+    return '"' + hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest() + '"'
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": PUBLIC_CACHE_CONTROL}
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """
+    304 se o cliente já tem esta versão (If-None-Match), senão None.
+    """
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers(etag))
+    return None
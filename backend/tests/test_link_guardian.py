@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import httpx
+
+from app import models
+from app.database import SessionLocal
+from app.services import link_guardian
+
+
+def _create_pro_product() -> int:
+    db = SessionLocal()
+    try:
+        user = models.BlackLinkUser(username=f"teste_guard_{uuid4().hex[:8]}", plan="pro")
+        db.add(user)
+        db.flush()
+        product = models.BlackLinkProduct(
+            owner_id=user.id,
+            title="Produto",
+            url=f"https://mercadolivre.com.br/{uuid4().hex}",
+            is_active=1,
+            is_featured=1,
+        )
+        db.add(product)
+        db.commit()
+        return product.id
+    finally:
+        db.close()
+
+
+def _product(product_id: int) -> models.BlackLinkProduct:
+    db = SessionLocal()
+    try:
+        return db.get(models.BlackLinkProduct, product_id)
+    finally:
+        db.close()
+
+
+def _age_strike(product_id: int) -> None:
+    # simula a próxima varredura (intervalo mínimo entre strikes já passou)
+    db = SessionLocal()
+    try:
+        product = db.get(models.BlackLinkProduct, product_id)
+        product.last_dead_check_at -= timedelta(seconds=link_guardian.STRIKE_MIN_GAP_SECONDS)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _sweep_as_workers(workers: int) -> None:
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda _: httpx.Response(404)))
+
+    async def run() -> None:
+        async with client:
+            await asyncio.gather(*(link_guardian._sweep(client) for _ in range(workers)))
+
+    asyncio.run(run())
+
+
+def test_single_dead_check_does_not_deactivate_even_with_many_workers():
+    product_id = _create_pro_product()
+
+    # 3 workers varrendo ao mesmo tempo = 1 strike só
+    _sweep_as_workers(3)
+
+    product = _product(product_id)
+    assert product.is_active == 1
+    assert product.dead_strike_count == 1
+
+
+def test_second_sweep_deactivates_and_resets_strikes():
+    product_id = _create_pro_product()
+
+    _sweep_as_workers(1)
+    _age_strike(product_id)
+    _sweep_as_workers(1)
+
+    product = _product(product_id)
+    assert product.is_active == 0
+    assert product.is_featured == 0
+    assert product.dead_strike_count == 0
+
+
+def test_recovered_link_resets_strikes():
+    product_id = _create_pro_product()
+
+    link_guardian._record_results([product_id], [])
+    assert _product(product_id).dead_strike_count == 1
+
+    link_guardian._record_results([], [product_id])
+    product = _product(product_id)
+    assert product.is_active == 1
+    assert product.dead_strike_count == 0
+
+
+def test_strike_within_gap_is_not_counted_twice():
+    product_id = _create_pro_product()
+
+    assert link_guardian._record_results([product_id], []) == [("Produto", 1, 1)]
+    # strike já contado nesta varredura: nada gravado, nada a logar
+    assert link_guardian._record_results([product_id], []) == []
+
+    product = _product(product_id)
+    assert product.is_active == 1
+    assert product.dead_strike_count == 1
+    assert product.last_dead_check_at <= datetime.now(timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from sqlalchemy import create_engine, event
+
+from app import database
+
+
+def _engine(tmp_path):
+    return create_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+
+
+def _capture_statements(engine) -> list:
+    statements: list = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _record(_conn, _cursor, statement, _params, _context, _executemany) -> None:
+        statements.append(statement)
+
+    return statements
+
+
+def _columns(engine, table: str) -> set:
+    with engine.connect() as conn:
+        return {r[1] for r in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+
+def _indexes(engine) -> set:
+    with engine.connect() as conn:
+        return {r[0] for r in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type='index'")}
+
+
+def _user_version(engine) -> int:
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def test_bootstrap_creates_schema_and_stamps_version(tmp_path):
+    engine = _engine(tmp_path)
+    database.ensure_sqlite_schema(engine)
+
+    assert _user_version(engine) == database._schema_version()
+    assert set(database.PRODUCT_COLS) <= _columns(engine, "blacklink_products")
+    assert set(database.INDEXES) <= _indexes(engine)
+
+
+def test_matching_version_skips_ddl(tmp_path):
+    engine = _engine(tmp_path)
+    database.ensure_sqlite_schema(engine)
+
+    statements = _capture_statements(engine)
+    database.ensure_sqlite_schema(engine)
+
+    # boot comum: só a leitura do PRAGMA
+    assert statements == ["PRAGMA user_version"]
+
+
+def test_legacy_table_gets_missing_columns_and_indexes(tmp_path):
+    engine = _engine(tmp_path)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE blacklink_users (id INTEGER PRIMARY KEY, username VARCHAR(50))")
+        conn.exec_driver_sql(
+            "CREATE TABLE blacklink_products (id INTEGER PRIMARY KEY, owner_id INTEGER, title VARCHAR(200))"
+        )
+
+    database.ensure_sqlite_schema(engine)
+
+    assert set(database.USER_COLS) <= _columns(engine, "blacklink_users")
+    assert set(database.PRODUCT_COLS) <= _columns(engine, "blacklink_products")
+    assert set(database.INDEXES) <= _indexes(engine)
+
+
+def test_schema_change_reruns_bootstrap(tmp_path, monkeypatch):
+    engine = _engine(tmp_path)
+    database.ensure_sqlite_schema(engine)
+    old_version = _user_version(engine)
+
+    monkeypatch.setitem(database.INDEXES, "ix_products_title", "blacklink_products (title)")
+    database.ensure_sqlite_schema(engine)
+
+    assert _user_version(engine) != old_version
+    assert "ix_products_title" in _indexes(engine)
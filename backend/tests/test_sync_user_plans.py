@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from app import models
+from app.database import SessionLocal
+from app.services.plan_manager import sync_user_plan, sync_user_plans
+
+_PAST = datetime(2020, 1, 1)
+_FUTURE = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(days=30)
+
+# (plan, plan_expires_at, last_paid_plan, last_paid_expires_at)
+_CASES = [
+    ("pro", _PAST, None, None),
+    (" DON ", _PAST, None, None),
+    ("weird", _PAST, None, None),
+    ("don", _PAST, "pro", datetime(2019, 6, 1)),
+    ("pro", _PAST, "", None),
+    ("pro", _FUTURE, None, None),
+]
+
+_FIELDS = (
+    "plan",
+    "plan_status",
+    "plan_started_at",
+    "plan_expires_at",
+    "last_paid_plan",
+    "last_paid_expires_at",
+)
+
+
+def _create_users(db) -> list:
+    users = []
+    for plan, expires, last_plan, last_expires in _CASES:
+        user = models.BlackLinkUser(
+            username=f"teste_sync_{uuid4().hex[:8]}",
+            plan=plan,
+            plan_status="active",
+            plan_started_at=datetime(2019, 1, 1),
+            plan_expires_at=expires,
+            last_paid_plan=last_plan,
+            last_paid_expires_at=last_expires,
+        )
+        db.add(user)
+        users.append(user)
+    db.commit()
+    return [u.id for u in users]
+
+
+def _snapshot(user_ids: list) -> list:
+    db = SessionLocal()
+    try:
+        return [
+            tuple(getattr(db.get(models.BlackLinkUser, uid), f) for f in _FIELDS)
+            for uid in user_ids
+        ]
+    finally:
+        db.close()
+
+
+def test_bulk_sync_matches_single_sync_for_expired_plans():
+    db = SessionLocal()
+    try:
+        single_ids = _create_users(db)
+        bulk_ids = _create_users(db)
+
+        for uid in single_ids[:-1]:  # só os vencidos (o último está em dia)
+            sync_user_plan(db, db.get(models.BlackLinkUser, uid))
+
+        assert sync_user_plans(db, bulk_ids) == len(_CASES) - 1
+    finally:
+        db.close()
+
+    single = _snapshot(single_ids)
+    bulk = _snapshot(bulk_ids)
+
+    assert bulk[:-1] == single[:-1]
+    assert [row[4] for row in bulk[:-1]] == ["pro", "don", "free", "pro", "pro"]
+
+    # plano em dia não é tocado
+    assert bulk[-1][0] == "pro"
+    assert bulk[-1][3] == _FUTURE
+
+
+def test_bulk_sync_is_idempotent():
+    db = SessionLocal()
+    try:
+        user_ids = _create_users(db)
+        assert sync_user_plans(db, user_ids) == len(_CASES) - 1
+        assert sync_user_plans(db, user_ids) == 0
+    finally:
+        db.close()
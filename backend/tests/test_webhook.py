@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import time
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from app import models
+from app.config import settings
+from app.database import SessionLocal
+from app.routers import webhook
+
+SECRET = "segredo-teste"
+
+
+def _sign(data_id: str, request_id: str, ts: int, secret: str = SECRET) -> str:
+    manifest = f"id:{data_id};request-id:{request_id};ts:{ts};"
+    v1 = hmac.new(secret.encode(), manifest.encode(), hashlib.sha256).hexdigest()
+    return f"ts={ts},v1={v1}"
+
+
+# ============================================================
+# x-signature
+# ============================================================
+def test_signature_accepts_fresh_timestamp():
+    ts = int(time.time())
+    assert webhook._valid_mp_signature(SECRET, _sign("123", "req-1", ts), "req-1", "123")
+
+
+def test_signature_accepts_millisecond_timestamp():
+    ts = int(time.time() * 1000)
+    assert webhook._valid_mp_signature(SECRET, _sign("123", "req-1", ts), "req-1", "123")
+
+
+def test_signature_rejects_stale_timestamp():
+    ts = int(time.time()) - settings.MP_SIGNATURE_TOLERANCE_SECONDS - 1
+    assert not webhook._valid_mp_signature(SECRET, _sign("123", "req-1", ts), "req-1", "123")
+
+
+def test_signature_rejects_tampered_fields():
+    ts = int(time.time())
+    signature = _sign("123", "req-1", ts)
+    assert not webhook._valid_mp_signature(SECRET, signature, "req-1", "999")
+    assert not webhook._valid_mp_signature(SECRET, signature, "req-2", "123")
+    assert not webhook._valid_mp_signature("outro", signature, "req-1", "123")
+    assert not webhook._valid_mp_signature(SECRET, "ts=abc,v1=00", "req-1", "123")
+    assert not webhook._valid_mp_signature(SECRET, None, "req-1", "123")
+
+
+def test_webhook_rejects_replayed_signature(client, monkeypatch):
+    monkeypatch.setattr(settings, "MP_WEBHOOK_SECRET", SECRET)
+
+    old_ts = int(time.time()) - 3600
+    r = client.post(
+        "/webhook/mercadopago?data.id=123",
+        json={"type": "payment", "data": {"id": "123"}},
+        headers={"x-signature": _sign("123", "req-1", old_ts), "x-request-id": "req-1"},
+    )
+    assert r.status_code == 403
+
+
+# ============================================================
+# processed_payments (idempotência)
+# ============================================================
+def _create_user(plan_expires_at=None) -> str:
+    db = SessionLocal()
+    try:
+        username = f"teste_wh_{uuid4().hex[:8]}"
+        db.add(models.BlackLinkUser(
+            username=username,
+            plan="pro" if plan_expires_at else "free",
+            plan_expires_at=plan_expires_at,
+        ))
+        db.commit()
+        return username
+    finally:
+        db.close()
+
+
+def _process(payment_id: str, username: str) -> dict:
+    db = SessionLocal()
+    try:
+        return webhook._process_approved_payment(
+            db, payment_id, {"external_reference": f"{username}:pro:1"}
+        )
+    finally:
+        db.close()
+
+
+def test_claim_payment_only_once():
+    payment_id = f"pay-{uuid4().hex}"
+    now = datetime.now(timezone.utc)
+
+    first, second = SessionLocal(), SessionLocal()
+    try:
+        assert webhook._claim_payment(first, payment_id, now)
+        first.commit()
+        assert not webhook._claim_payment(second, payment_id, now)
+    finally:
+        first.close()
+        second.close()
+
+
+def test_redelivered_payment_is_applied_once():
+    expires = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(days=10)
+    username = _create_user(plan_expires_at=expires)
+    payment_id = f"pay-{uuid4().hex}"
+
+    first = _process(payment_id, username)
+    second = _process(payment_id, username)
+
+    assert first["status"] == "processed"
+    assert second == {"status": "ignored", "reason": "Pagamento já processado"}
+
+    db = SessionLocal()
+    try:
+        user = db.query(models.BlackLinkUser).filter_by(username=username).one()
+        # renovação aplicada uma única vez: +30 dias sobre o vencimento atual
+        assert user.plan_expires_at == expires + timedelta(days=30)
+        assert db.query(models.ProcessedPayment).filter_by(mp_payment_id=payment_id).count() == 1
+    finally:
+        db.close()
+
+
+def test_distinct_payments_both_renew():
+    expires = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(days=10)
+    username = _create_user(plan_expires_at=expires)
+
+    _process(f"pay-{uuid4().hex}", username)
+    _process(f"pay-{uuid4().hex}", username)
+
+    db = SessionLocal()
+    try:
+        user = db.query(models.BlackLinkUser).filter_by(username=username).one()
+        assert user.plan_expires_at == expires + timedelta(days=60)
+    finally:
+        db.close()
@@ -5,10 +5,15 @@
 
 import json
 import os
+from functools import lru_cache
 
+import orjson
+
+@lru_cache(maxsize=1)
 def load_config():
-    with open('blacklink_config.json', 'r', encoding='utf8') as f:
-        return json.load(f)
+    # lido uma vez por processo (dict compartilhado: não mutar)
+    with open('blacklink_config.json', 'rb') as f:
+        return orjson.loads(f.read())
 
 def gerar_link_curto(nome: str):
     nome = nome.lower().replace(' ', '-')
@@ -29,10 +34,11 @@ def criar_blacklink(nome, descricao='', instagram='', tiktok='', youtube='', tel
         "blacklink": link_curto
     }
 
-    # Salvar JSON do usuário
+    # Salvar JSON do usuário (mesmo formato: indent=4, UTF-8 legível),
+    # serializado em memória e gravado num único write
     output_path = f"blacklink_{nome}.json"
     with open(output_path, 'w', encoding='utf8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+        f.write(json.dumps(data, indent=4, ensure_ascii=False))
 
     return link_curto
 
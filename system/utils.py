@@ -1,5 +1,11 @@
 # utilidades gerais do BlackLink
+from functools import lru_cache
+
+import orjson
+
+
+@lru_cache(maxsize=1)
 def load_config():
-    import json
-    with open('blacklink_config.json', 'r', encoding='utf8') as f:
-        return json.load(f)
+    # lido uma vez por processo (dict compartilhado: não mutar)
+    with open('blacklink_config.json', 'rb') as f:
+        return orjson.loads(f.read())